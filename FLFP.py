@@ -1,7 +1,11 @@
 import subprocess
 import sys
 import os
-import requests
+import re
+import time
+import threading
+import importlib
+from importlib import metadata
 import yaml
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -10,6 +14,9 @@ VERSION = '2.4'
 
 # Get the directory of the script being executed
 script_dir = Path(__file__).parent
+# Modules are imported when a method runs, so the menu doesn't wait for requests and plexapi to load
+sys.path.insert(0, str(script_dir / "Modules"))
+
 requirements_path = script_dir / "requirements.txt"
 config_path = script_dir / "config.yml"
 
@@ -21,6 +28,10 @@ RED = '\033[31m'
 RESET = '\033[0m'
 BOLD = '\033[1m'
 
+GITHUB_API_URL = "https://api.github.com/repos/netplexflix/Finale-Labeler-For-Plex/releases/latest"
+UPDATE_CHECK_FILE = "update_check.json"
+UPDATE_CHECK_TTL = 24 * 3600  # Seconds the latest release version is cached in Cache/
+
 def load_config():
     try:
         with config_path.open("r", encoding="utf-8") as file:
@@ -35,6 +46,27 @@ config = load_config()
 # Retrieve launch_method from config.yml
 general_config = config.get("general", {})
 launch_method = general_config.get("launch_method", 0)
+run_methods_concurrently = general_config.get("run_methods_concurrently", False)
+
+def setup_http():
+    """Apply the http settings of config.yml and the --no-cache option to the shared HTTP client."""
+    import http_client
+    http_client.configure(config)
+    if '--no-cache' in sys.argv[1:]:
+        http_client.disable_cache()
+    return http_client
+
+def parse_version(version):
+    """'v4.16.1' -> (4, 16, 1), so versions compare by number. Suffixes such as 'rc1' are ignored."""
+    parts = []
+    for part in version.strip().lstrip('v').split('.'):
+        digits = re.match(r'\d+', part)
+        if not digits:
+            break
+        parts.append(int(digits.group()))
+    while parts and parts[-1] == 0:
+        parts.pop()  # 4.16 == 4.16.0
+    return tuple(parts)
 
 def check_requirements():
     print("\nChecking requirements:")
@@ -49,18 +81,14 @@ def check_requirements():
                 continue
             try:
                 pkg_name, required_version = req.split("==")
-                installed_version = subprocess.check_output(
-                    [sys.executable, "-m", "pip", "show", pkg_name]
-                ).decode().split("Version: ")[1].split("\n")[0]
+                installed_version = metadata.version(pkg_name)
 
-                if installed_version == required_version:
-                    print(f"{pkg_name}: {GREEN}OK{RESET}")
-                elif installed_version < required_version:
+                if parse_version(installed_version) < parse_version(required_version):
                     print(f"{pkg_name}: {ORANGE}Upgrade needed{RESET}")
                     unmet_requirements.append(req)
                 else:
                     print(f"{pkg_name}: {GREEN}OK{RESET}")
-            except (IndexError, subprocess.CalledProcessError):
+            except metadata.PackageNotFoundError:
                 print(f"{pkg_name}: {RED}Missing{RESET}")
                 unmet_requirements.append(req)
 
@@ -75,40 +103,264 @@ def check_requirements():
         sys.exit(f"{RED}Error checking requirements: {e}{RESET}")
 
 def is_newer_version(remote_version, current_version):
-    def parse_version(v):
-        return [int(x) for x in v.strip('v').split('.')]
-    
     try:
         return parse_version(remote_version) > parse_version(current_version)
     except Exception:
         return False
 
-def check_for_updates(current_version):
-    GITHUB_API_URL = "https://api.github.com/repos/netplexflix/Finale-Labeler-For-Plex/releases/latest"
+def get_latest_version():
+    """Version of the latest GitHub release, from the on-disk cache while it is less than UPDATE_CHECK_TTL old."""
+    from cache_store import load_json, save_json
+    cached = load_json(UPDATE_CHECK_FILE, {})
+    if cached.get('version') and time.time() - cached.get('checked_at', 0) < UPDATE_CHECK_TTL:
+        return cached['version']
+
+    response = setup_http().get('github', GITHUB_API_URL)
+    response.raise_for_status()
+    remote_version = response.json().get("tag_name", "").lstrip('v')
+    if remote_version:
+        try:
+            save_json(UPDATE_CHECK_FILE, {'version': remote_version, 'checked_at': time.time()})
+        except OSError:
+            pass  # Checked again next time
+    return remote_version
+
+def start_update_check():
+    """Look up the latest release on a background thread, so the menu never waits for GitHub."""
+    result = {}
+
+    def check():
+        try:
+            result['version'] = get_latest_version()
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=check, daemon=True)
+    thread.start()
+    return thread, result
+
+def report_update(update_check, current_version, timeout=0):
+    """Print the result of the update check once it is available, waiting at most `timeout` seconds."""
+    thread, result = update_check
+    thread.join(timeout)
+    if thread.is_alive() or result.get('reported'):
+        return
+    result['reported'] = True
+    if 'error' in result:
+        print(f"{RED}ERROR: Failed to check for updates: {result['error']}{RESET}")
+    elif not result.get('version'):
+        print(f"{RED}Could not determine the latest version from GitHub Releases.{RESET}")
+    elif is_newer_version(result['version'], current_version):
+        print(f"{ORANGE}A newer version (v{result['version']}) is available.{RESET}")
+
+METHODS = {
+    "Sonarr": "Method 1: Sonarr",
+    "Trakt": "Method 2: Trakt",
+}
+
+def create_plex_context():
+    """One Plex context for every method of this run, so the library is listed and indexed once."""
+    from plex_context import PlexContext
+    plex_config = config['plex']
+    return PlexContext(
+        plex_config['url'], plex_config['token'], plex_config['library_title'],
+        plex_config.get('cache_guid_index', True)
+    )
+
+def run_method(module_name, plex_ctx=None, buffered=False):
+    """
+    Run one method in this process. Methods share the loaded config, the HTTP connection pools
+    and, when given, the Plex context. Returns the method's summary, or None if it failed.
+    """
     try:
-        response = requests.get(GITHUB_API_URL)
-        response.raise_for_status()
-        data = response.json()
-        remote_version = data.get("tag_name", "").lstrip('v')
-        if not remote_version:
-            print(f"{RED}Could not determine the latest version from GitHub Releases.{RESET}")
-            return
-        if is_newer_version(remote_version, current_version):
-            print(f"{ORANGE}A newer version (v{remote_version}) is available.{RESET}")
-    except Exception as e:
-        print(f"{RED}ERROR: Failed to check for updates: {e}{RESET}")
+        method = importlib.import_module(module_name)
+        return method.run(config, plex_ctx, buffered)
+    except SystemExit as error:
+        # Configuration and connection errors end the method, not FLFP
+        if error.code not in (None, 0):
+            print(f"{RED}An error occurred while running {module_name}: exit code {error.code}{RESET}")
+    except Exception as error:
+        print(f"{RED}An error occurred while running {module_name}: {error}{RESET}")
+    return None
+
+def run_methods(module_names, plex_ctx=None):
+    """
+    Run the selected methods, side by side if run_methods_concurrently is enabled.
+    Returns {method: summary or None}.
+    """
+    if len(module_names) == 1:
+        print(f"{BOLD}{BLUE}Running {METHODS[module_names[0]]}{RESET}")
+        return {module_names[0]: run_method(module_names[0], plex_ctx)}
+
+    plex_ctx = plex_ctx or create_plex_context()
+    if not run_methods_concurrently:
+        results = {}
+        for module_name in module_names:
+            print(f"{BOLD}{BLUE}Running {METHODS[module_name]}{RESET}")
+            results[module_name] = run_method(module_name, plex_ctx)
+        return results
+
+    print(f"{BOLD}{BLUE}Running {' and '.join(METHODS[name] for name in module_names)} concurrently{RESET}")
+    try:
+        # Load the shared Plex data up front, the methods then only read it and write labels under its lock
+        plex_ctx.snapshot
+        plex_ctx.id_map
+    except (SystemExit, Exception) as error:
+        print(f"{RED}An error occurred while loading the Plex library: {error}{RESET}")
+        return dict.fromkeys(module_names)
+    # Each method's output is buffered and printed in one piece when it finishes
+    from concurrency import run_concurrently
+    summaries = run_concurrently(
+        *(lambda name=module_name: run_method(name, plex_ctx, buffered=True) for module_name in module_names)
+    )
+    return dict(zip(module_names, summaries))
+
+def format_cycle_summary(cycle, results, elapsed):
+    """One line per daemon cycle: runtime and, per method, finales found and labels changed."""
+    parts = []
+    for module_name, summary in results.items():
+        if summary is None:
+            parts.append(f"{module_name}: {RED}failed{RESET}")
+        else:
+            parts.append(
+                f"{module_name}: {summary['finales']} finale(s), "
+                f"{GREEN}+{summary['added']}{RESET}/{RED}-{summary['removed']}{RESET} label(s)"
+            )
+    runtime = str(timedelta(seconds=int(elapsed)))
+    return f"Cycle {cycle} finished in {runtime} | " + " | ".join(parts)
+
+def install_stop_handlers(message):
+    """
+    Turn SIGINT/SIGTERM into a stop request for a long-running mode. Returns the Event that is set
+    on the first signal; a second signal raises KeyboardInterrupt to stop right away.
+    """
+    import signal
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print(f"\n{ORANGE}{message}{RESET}")
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    return stop
+
+def run_daemon(module_names):
+    """
+    --daemon: run the methods every daemon_interval_minutes in one long-lived process. The Plex
+    connection, the GUID index, the episode data of unchanged shows, the HTTP connection pools and
+    rate limiters stay warm between cycles. SIGINT/SIGTERM stop the daemon after the current cycle.
+    """
+    from run_logging import method_log
+
+    interval = general_config.get("daemon_interval_minutes", 30)
+    if not isinstance(interval, (int, float)) or interval <= 0:
+        print(f"{RED}ERROR: daemon_interval_minutes must be a positive number of minutes.{RESET}")
+        sys.exit(1)
+
+    stop = install_stop_handlers("Stopping the daemon after the current cycle...")
+    plex_ctx = create_plex_context()
+    cycle = 0
+    with method_log("Daemon"):
+        print(f"{BOLD}{BLUE}Daemon started: {' and '.join(METHODS[name] for name in module_names)} "
+              f"every {interval} minute(s){RESET}")
+        try:
+            while not stop.is_set():
+                cycle += 1
+                cycle_start = time.time()
+                print(f"\n{BOLD}{BLUE}=== Cycle {cycle} ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}) ==={RESET}")
+                if cycle > 1:
+                    plex_ctx.new_cycle()
+                results = run_methods(module_names, plex_ctx)
+                elapsed = time.time() - cycle_start
+                print(format_cycle_summary(cycle, results, elapsed))
+
+                next_run = datetime.now() + timedelta(seconds=max(0, interval * 60 - elapsed))
+                if not stop.is_set():
+                    print(f"Next cycle at {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+                stop.wait(max(0, interval * 60 - elapsed))
+        except KeyboardInterrupt:
+            print(f"{ORANGE}Daemon interrupted during cycle {cycle}.{RESET}")
+        finally:
+            import http_client
+            http_client.close_all()
+        print(f"{BOLD}{BLUE}Daemon stopped after {cycle} cycle(s).{RESET}")
+
+def run_listener(module_names):
+    """
+    --listen: relabel single shows when Sonarr imports an episode or Plex adds one, instead of
+    waiting for the next full run. Every event costs a few requests for the affected show only.
+    """
+    from run_logging import method_log
+    from relabel import relabel, format_relabel_summary
+    from webhook import WebhookServer, DEFAULT_HOST, DEFAULT_PORT
+
+    webhook_config = config.get("webhook") or {}
+    host = webhook_config.get("host", DEFAULT_HOST)
+    port = webhook_config.get("port", DEFAULT_PORT)
+    token = webhook_config.get("token") or None
+
+    plex_ctx = create_plex_context()
+
+    def handle_targets(targets):
+        print(format_relabel_summary(relabel(config, plex_ctx, module_names, targets)))
+
+    stop = install_stop_handlers("Stopping the webhook listener...")
+    with method_log("Webhook"):
+        try:
+            server = WebhookServer((host, port), token, handle_targets)
+        except OSError as e:
+            print(f"{RED}ERROR: Could not listen on {host}:{port}: {e}{RESET}")
+            sys.exit(1)
+        server.start()
+        print(f"{BOLD}{BLUE}Listening for webhooks on http://{host}:{port}/sonarr and http://{host}:{port}/plex{RESET}")
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            import http_client
+            http_client.close_all()
+        print(f"{BOLD}{BLUE}Webhook listener stopped.{RESET}")
+
+def run_relabel(module_names, series_ids):
+    """--relabel: re-evaluate the finale labels of the given series only, see relabel.parse_series_ids()."""
+    from run_logging import method_log
+    from relabel import parse_series_ids, relabel, format_relabel_summary
 
-def run_script(script_name):
     try:
-        script_path = script_dir / "Modules" / script_name
-        subprocess.run([sys.executable, str(script_path)], check=True)
-    except subprocess.CalledProcessError as error:
-        print(f"{RED}An error occurred while running {script_name}: {error}{RESET}")
+        targets = parse_series_ids(series_ids)
+    except ValueError as e:
+        print(f"{RED}ERROR: {e}{RESET}")
+        sys.exit(1)
+    if not targets:
+        print(f"{RED}ERROR: --relabel needs at least one series ID, e.g. --relabel tvdb:81189 imdb:tt0903747{RESET}")
+        sys.exit(1)
+
+    with method_log("Relabel"):
+        print(format_relabel_summary(relabel(config, create_plex_context(), module_names, targets)))
 
-def display_title_and_methods():
+def option_values(option):
+    """Command line values following `option` up to the next option, or None if it isn't given."""
+    args = sys.argv[1:]
+    if option not in args:
+        return None
+    values = []
+    for arg in args[args.index(option) + 1:]:
+        if arg.startswith('--'):
+            break
+        values.append(arg)
+    return values
+
+def display_title_and_methods(update_check):
     title = f"{BOLD}{BLUE}{'*' * 40}\nPlex Finale Labeler {VERSION}\n{'*' * 40}{RESET}"
     print(title)
-    check_for_updates(VERSION)
+    # Shown now if the check already finished (e.g. from the cache), otherwise after the run
+    report_update(update_check, VERSION)
     explanation = f"""
 Make sure you have correctly configured config.yml
 
@@ -120,40 +372,47 @@ Uses your Trakt API to get the episode_types.
 """
     print(explanation)
 
-def validate_path_config(config):
-    paths_config = config.get('paths', {})
-    platform = paths_config.get('platform')
-    
-    if platform and platform not in ['windows', 'linux', 'nas', 'docker']:
-        print(f"{RED}ERROR: Invalid platform in config. Must be one of: windows, linux, nas, docker{RESET}")
+def main():
+    daemon = '--daemon' in sys.argv[1:]
+    listen = '--listen' in sys.argv[1:]
+    relabel_ids = option_values('--relabel')
+    modes = [option for option, given in (('--daemon', daemon), ('--listen', listen), ('--relabel', relabel_ids is not None)) if given]
+    if len(modes) > 1:
+        print(f"{RED}ERROR: {' and '.join(modes)} can't be combined.{RESET}")
+        sys.exit(1)
+    if modes and launch_method not in [1, 2, 3]:
+        print(f"{RED}ERROR: Set launch_method to 1, 2 or 3 in config.yml to run with {modes[0]}.{RESET}")
         sys.exit(1)
-        
-    mappings = paths_config.get('path_mappings', {})
-    if mappings:
-        for source, target in mappings.items():
-            if not source or not target:
-                print(f"{RED}ERROR: Invalid path mapping: {source} -> {target}{RESET}")
-                sys.exit(1)
 
-def main():
+    update_check = None
     if launch_method == 0:
         check_requirements()
+        # Only started once the requirements are known to be installed
+        update_check = start_update_check()
     
     start_time = datetime.now()
     consecutive_run = False
 
-    validate_path_config(config)
-
     if launch_method in [1, 2, 3]:
+        module_names = []
         if launch_method in [1, 3]:
-            print(f"{BOLD}{BLUE}Running Method 1: Sonarr{RESET}")
-            run_script("Sonarr.py")
+            module_names.append("Sonarr")
         if launch_method in [2, 3]:
-            print(f"{BOLD}{BLUE}Running Method 2: Trakt{RESET}")
-            run_script("Trakt.py")
+            module_names.append("Trakt")
+        setup_http()
+        if daemon:
+            run_daemon(module_names)
+            return
+        if listen:
+            run_listener(module_names)
+            return
+        if relabel_ids is not None:
+            run_relabel(module_names, relabel_ids)
+            return
+        run_methods(module_names)
         consecutive_run = launch_method == 3
     else:
-        display_title_and_methods()
+        display_title_and_methods(update_check)
         print(f"{BOLD}{GREEN}Select a method:{RESET}")
         print("1: Method 1 (Sonarr)")
         print("2: Method 2 (Trakt)")
@@ -162,26 +421,26 @@ def main():
         choice = input("Enter your choice (1, 2, or 3): ").strip()
         print("===================\n")
 
+        if choice not in ("1", "2", "3"):
+            print(f"{RED}Invalid selection. Please run the script again and choose 1, 2, or 3.{RESET}")
+            return
+        # requests is only imported once a method is about to run, not while the menu waits
+        setup_http()
         if choice == "1":
-            print(f"{BOLD}{BLUE}Running Method 1: Sonarr{RESET}")
-            run_script("Sonarr.py")
+            run_methods(["Sonarr"])
         elif choice == "2":
-            print(f"{BOLD}{BLUE}Running Method 2: Trakt{RESET}")
-            run_script("Trakt.py")
-        elif choice == "3":
-            consecutive_run = True
-            print(f"{BOLD}{BLUE}Running Method 1: Sonarr{RESET}")
-            run_script("Sonarr.py")
-            print(f"{BOLD}{BLUE}Running Method 2: Trakt{RESET}")
-            run_script("Trakt.py")
+            run_methods(["Trakt"])
         else:
-            print(f"{RED}Invalid selection. Please run the script again and choose 1, 2, or 3.{RESET}")
-            return
+            consecutive_run = True
+            run_methods(["Sonarr", "Trakt"])
     
     if consecutive_run:
         end_time = datetime.now()
         total_runtime = str(timedelta(seconds=int((end_time - start_time).total_seconds())))
         print(f"\nTotal Runtime: {total_runtime}")
 
+    if update_check:
+        report_update(update_check, VERSION, timeout=setup_http().get_timeout('github'))
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
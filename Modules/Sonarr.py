@@ -1,55 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
 import sys
 import yaml
-import re
 import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime as dt
 from pathlib import Path
-from path_handler import PathHandler
-
-# Set up logging
-script_name = os.path.splitext(os.path.basename(__file__))[0]  # Get script name without extension
-logs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Logs", script_name)
-os.makedirs(logs_dir, exist_ok=True)
-log_file = os.path.join(logs_dir, f"log_{dt.now().strftime('%Y%m%d_%H%M%S')}.txt")
-
-class Logger:
-    def __init__(self, log_file):
-        self.terminal = sys.stdout
-        self.log = open(log_file, "a", encoding="utf-8")  # Specify UTF-8 encoding
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        self.terminal.flush()
-        self.log.flush()
-
-sys.stdout = Logger(log_file)
-sys.stderr = Logger(log_file)
-
-# Clean up old logs
-def clean_old_logs():
-    log_files = sorted(
-        [os.path.join(logs_dir, f) for f in os.listdir(logs_dir) if f.startswith("log_")],
-        key=os.path.getmtime
-    )
-    while len(log_files) > 31:
-        os.remove(log_files.pop(0))
-
-clean_old_logs()
 
 import requests
-try:
-    from plexapi.server import PlexServer
-except ImportError:
-    print("ERROR: python-plexapi is not installed. Run: pip install plexapi")
-    sys.exit(1)
+import http_client
+from concurrency import run_concurrently
+from plex_context import PlexContext, LabelBatch, get_plex_show_by_ids
+from run_logging import method_log, propagate_output
 	
 # ANSI color codes
 GREEN = '\033[32m'
@@ -81,22 +45,7 @@ def load_config():
     config_path = current_dir.parent / "config.yml"
     try:
         with open(config_path, "r") as file:
-            config = yaml.safe_load(file)
-            
-            # Normalize Sonarr URL
-            if 'sonarr' in config and 'url' in config['sonarr']:
-                config['sonarr']['url'] = normalize_sonarr_url(config['sonarr']['url'])
-            else:
-                print(f"{RED}ERROR: Sonarr URL not found in config.yml. Please check your configuration.{RESET}")
-                sys.exit(1)
-                
-            if not config['sonarr'].get('api_key'):
-                print(f"{RED}ERROR: Sonarr API key not found in config.yml. Please check your configuration.{RESET}")
-                sys.exit(1)
-            
-            global path_handler
-            path_handler = PathHandler(config)
-            return config
+            return yaml.safe_load(file)
     except FileNotFoundError:
         print(f"{RED}ERROR: Could not find config.yml at {config_path}.{RESET}")
         sys.exit(1)
@@ -107,26 +56,55 @@ def load_config():
         print(f"{RED}ERROR: An error occurred while loading config.yml: {str(e)}{RESET}")
         sys.exit(1)
 
-config = load_config()
+def init(config):
+    """
+    Validate the Sonarr method settings of a loaded config.yml and apply them to this module.
+    Runs at the start of every run, nothing is read from config.yml on import.
+    """
+    global SONARR_URL, SONARR_API_KEY, SONARR_MAX_WORKERS, SONARR_PREFILTER_SERIES
+    global SONARR_MODE, SONARR_CALENDAR_FUTURE_DAYS, PLEX_URL, PLEX_TOKEN, PLEX_LIBRARY_TITLE
+    global PLEX_CACHE_GUID_INDEX, RECENT_DAYS, SKIP_UNMONITORED, SKIP_GENRES, GENRES_TO_SKIP
+    global SKIP_LABELS, LABELS_TO_SKIP, LABEL_SERIES_IN_PLEX, PLEX_LABEL
+    global REMOVE_LABELS_IF_NO_LONGER_MATCHED, ONLY_FINALE_UNWATCHED
+
+    if 'sonarr' not in config or 'url' not in config['sonarr']:
+        print(f"{RED}ERROR: Sonarr URL not found in config.yml. Please check your configuration.{RESET}")
+        sys.exit(1)
+
+    if not config['sonarr'].get('api_key'):
+        print(f"{RED}ERROR: Sonarr API key not found in config.yml. Please check your configuration.{RESET}")
+        sys.exit(1)
 
-# Extract configurations
-SONARR_URL = config['sonarr']['url']
-SONARR_API_KEY = config['sonarr']['api_key']
+    # Extract configurations
+    SONARR_URL = normalize_sonarr_url(config['sonarr']['url'])
+    SONARR_API_KEY = config['sonarr']['api_key']
+    SONARR_MAX_WORKERS = max(1, int(config['sonarr'].get('max_workers', 1)))
+    SONARR_PREFILTER_SERIES = config['sonarr'].get('prefilter_series', True)
+    SONARR_MODE = config['sonarr'].get('mode', 'series')
+    SONARR_CALENDAR_FUTURE_DAYS = config['sonarr'].get('calendar_future_days', 365)
 
-PLEX_URL = config['plex']['url']
-PLEX_TOKEN = config['plex']['token']
-PLEX_LIBRARY_TITLE = config['plex']['library_title']
+    if SONARR_MODE not in ('series', 'calendar'):
+        print(f"{RED}ERROR: Invalid sonarr mode '{SONARR_MODE}' in config.yml. Must be one of: series, calendar{RESET}")
+        sys.exit(1)
 
-RECENT_DAYS = config['general']['recent_days']
-SKIP_UNMONITORED = config['general']['skip_unmonitored']
-SKIP_GENRES = config['general']['skip_genres']
-GENRES_TO_SKIP = config['general']['genres_to_skip']
-SKIP_LABELS = config['general']['skip_labels']
-LABELS_TO_SKIP = config['general']['labels_to_skip']
-LABEL_SERIES_IN_PLEX = config['general']['label_series_in_plex']
-PLEX_LABEL = config['general']['plex_label']
-REMOVE_LABELS_IF_NO_LONGER_MATCHED = config['general']['remove_labels_if_no_longer_matched']
-ONLY_FINALE_UNWATCHED = config['general']['only_finale_unwatched']
+    PLEX_URL = config['plex']['url']
+    PLEX_TOKEN = config['plex']['token']
+    PLEX_LIBRARY_TITLE = config['plex']['library_title']
+    PLEX_CACHE_GUID_INDEX = config['plex'].get('cache_guid_index', True)
+
+    RECENT_DAYS = config['general']['recent_days']
+    SKIP_UNMONITORED = config['general']['skip_unmonitored']
+    SKIP_GENRES = config['general']['skip_genres']
+    GENRES_TO_SKIP = config['general']['genres_to_skip']
+    SKIP_LABELS = config['general']['skip_labels']
+    LABELS_TO_SKIP = config['general']['labels_to_skip']
+    LABEL_SERIES_IN_PLEX = config['general']['label_series_in_plex']
+    PLEX_LABEL = config['general']['plex_label']
+    REMOVE_LABELS_IF_NO_LONGER_MATCHED = config['general']['remove_labels_if_no_longer_matched']
+    ONLY_FINALE_UNWATCHED = config['general']['only_finale_unwatched']
+
+    # Episode files are only memoized within one run
+    _episode_files_cache.clear()
 
 # ----------------------#
 #  Sonarr Finale Logic  #
@@ -135,7 +113,7 @@ def get_sonarr_series():
     """Get all series from Sonarr with improved error handling."""
     try:
         url = f"{SONARR_URL}/series?apikey={SONARR_API_KEY}"
-        resp = requests.get(url, timeout=10)  # Add timeout
+        resp = http_client.get('sonarr', url)
         
         # Handle common HTTP errors
         if resp.status_code == 401:
@@ -169,91 +147,197 @@ def get_sonarr_series():
         print(f"{RED}ERROR: Unexpected error while connecting to Sonarr: {str(e)}{RESET}")
         sys.exit(1)
 
+def get_sonarr_series_by_id(series_id):
+    """One series from Sonarr by its Sonarr ID, or None if Sonarr doesn't have it (anymore)."""
+    resp = http_client.get('sonarr', f"{SONARR_URL}/series/{series_id}?apikey={SONARR_API_KEY}")
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return resp.json()
+
+def get_sonarr_series_by_tvdb_id(tvdb_id):
+    """The series with this TVDB ID, or None. Sonarr filters the list itself, so it stays one small response."""
+    resp = http_client.get('sonarr', f"{SONARR_URL}/series?tvdbId={tvdb_id}&apikey={SONARR_API_KEY}")
+    resp.raise_for_status()
+    series = resp.json()
+    return series[0] if series else None
+
 def get_sonarr_episodes(series_id):
     url = f"{SONARR_URL}/episode?seriesId={series_id}&apikey={SONARR_API_KEY}"
-    resp = requests.get(url)
+    resp = http_client.get('sonarr', url)
+    resp.raise_for_status()
+    return resp.json()
+
+def get_sonarr_calendar(start, end):
+    """Get every episode (monitored or not) airing between start and end from the Sonarr calendar."""
+    url = (f"{SONARR_URL}/calendar?start={start.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+           f"&end={end.strftime('%Y-%m-%dT%H:%M:%SZ')}&unmonitored=true&apikey={SONARR_API_KEY}")
+    resp = http_client.get('sonarr', url)
     resp.raise_for_status()
     return resp.json()
 
-def is_episode_downloaded(season_number, episode_number, series_id):
+def build_download_index(episodes):
+    """Map (season, episode) to the Sonarr episode file id for every episode that has a file."""
+    download_index = {}
+    for e in episodes:
+        if e.get('hasFile') and e.get('episodeFileId'):
+            download_index[(e.get('seasonNumber'), e.get('episodeNumber'))] = e['episodeFileId']
+    return download_index
+
+# Episode files per series, fetched at most once per run
+_episode_files_cache = {}
+
+def get_sonarr_episode_files(series_id):
+    """Return the episode files of a series keyed by episode file id (memoized per series)."""
+    if series_id in _episode_files_cache:
+        return _episode_files_cache[series_id]
+
     url = f"{SONARR_URL}/episodefile?seriesId={series_id}&apikey={SONARR_API_KEY}"
-    resp = requests.get(url)
+    resp = http_client.get('sonarr', url)
     if resp.status_code == 400:
+        episode_files = {}
+    else:
+        resp.raise_for_status()
+        episode_files = {ef['id']: ef for ef in resp.json()}
+
+    _episode_files_cache[series_id] = episode_files
+    return episode_files
+
+def is_episode_downloaded(season_number, episode_number, series_id, download_index):
+    episode_file_id = download_index.get((season_number, episode_number))
+    if not episode_file_id:
         return False
-    resp.raise_for_status()
 
-    episode_files = resp.json()
-    needle = f"s{season_number:02d}e{episode_number:02d}"
-    for ef in episode_files:
-        # Map the path from Sonarr to local system
-        relative_path = path_handler.map_path(ef.get('relativePath', ''))
-        if needle in relative_path.lower() and ef.get('size', 0) > 0:
-            return True
-    return False
+    # Only series with a candidate file pay for the episode file lookup
+    episode_file = get_sonarr_episode_files(series_id).get(episode_file_id)
+    return bool(episode_file) and episode_file.get('size', 0) > 0
 
-def get_recent_finales():
-    cutoff_date = dt.now() - timedelta(days=RECENT_DAYS)
+def parse_sonarr_date(value):
+    """Parse a Sonarr UTC timestamp ('2024-03-21T07:00:00Z'), returning None if missing or invalid."""
+    if not value:
+        return None
+    try:
+        return dt.fromisoformat(value.rstrip('Z'))
+    except ValueError:
+        return None
+
+def series_may_have_finale(s, cutoff_date):
+    """
+    Use the /series payload to decide whether a series can have a finale on or after the cutoff date.
+    Only returns False when the airing statistics rule it out, so unknown data never skips a series.
+    Sonarr only reports airings of monitored episodes, so this is only used with skip_unmonitored.
+    """
+    seasons = [se for se in s.get('seasons', []) if se.get('seasonNumber', 0) > 0]
+    seasons_with_stats = [se for se in seasons if 'statistics' in se]
+
+    if seasons_with_stats and len(seasons_with_stats) == len(seasons):
+        populated = [se for se in seasons_with_stats if se['statistics'].get('totalEpisodeCount', 0) > 0]
+        if not populated:
+            return False  # No episodes outside of specials
+        # The finale is always in the last season, so only its airings matter. The series-level
+        # dates may belong to an earlier season and are never used in their place.
+        stats = max(populated, key=lambda se: se['seasonNumber'])['statistics']
+        next_airing = parse_sonarr_date(stats.get('nextAiring'))
+        previous_airing = parse_sonarr_date(stats.get('previousAiring'))
+    else:
+        stats = s.get('statistics') or {}
+        next_airing = parse_sonarr_date(stats.get('nextAiring') or s.get('nextAiring'))
+        previous_airing = parse_sonarr_date(stats.get('previousAiring') or s.get('previousAiring'))
+
+    if next_airing:
+        return True
+    if not previous_airing:
+        # Ended or upcoming series without airing info can't be ruled out
+        return True
+    return previous_airing >= cutoff_date
+
+def evaluate_series(s, cutoff_date):
+    """Fetch the episodes of one series and return its (downloaded, not downloaded) finales."""
     finales_downloaded = []
     finales_not_downloaded = []
 
-    all_series = get_sonarr_series()
-    for s in all_series:
-        if SKIP_UNMONITORED and not s.get('monitored', True):
-            continue
+    episodes = get_sonarr_episodes(s['id'])
+    if not episodes:
+        return finales_downloaded, finales_not_downloaded
 
-        episodes = get_sonarr_episodes(s['id'])
-        if not episodes:
-            continue
+    valid_seasons = [e['seasonNumber'] for e in episodes if e.get('seasonNumber', 0) > 0]
+    if not valid_seasons:
+        return finales_downloaded, finales_not_downloaded
+    last_season = max(valid_seasons)
 
-        valid_seasons = [e['seasonNumber'] for e in episodes if e.get('seasonNumber', 0) > 0]
-        if not valid_seasons:
-            continue
-        last_season = max(valid_seasons)
+    # Only the last episode of the last season can be a finale
+    last_season_eps = [e for e in episodes if e.get('seasonNumber') == last_season]
+    last_ep = max(last_season_eps, key=lambda x: x['episodeNumber'])
+    air_date_utc = last_ep.get('airDateUtc')
+    if not air_date_utc:
+        return finales_downloaded, finales_not_downloaded
 
-        season_map = {}
-        for e in episodes:
-            snum = e.get('seasonNumber', 0)
-            if snum > 0:
-                season_map.setdefault(snum, []).append(e)
+    try:
+        air_date = dt.fromisoformat(air_date_utc.rstrip('Z'))
+    except ValueError:
+        print(f"{RED}ERROR: Invalid airDateUtc format for episode '{last_ep.get('title', 'N/A')}' in show '{s.get('title', 'N/A')}'{RESET}")
+        return finales_downloaded, finales_not_downloaded
+
+    download_index = build_download_index(last_season_eps)
+    snum = last_season
+    tmdb_id = s.get('tmdbId', 'N/A')
+    imdb_id = s.get('imdbId', 'N/A')
+    monitored = s.get('monitored', False)
+
+    if cutoff_date <= air_date <= dt.now():
+        downloaded = is_episode_downloaded(last_ep['seasonNumber'], last_ep['episodeNumber'], s['id'], download_index)
+        if downloaded:
+            finales_downloaded.append((
+                s['title'], snum, last_ep['episodeNumber'], last_ep['title'],
+                air_date.date(), tmdb_id, imdb_id, monitored
+            ))
+        else:
+            finales_not_downloaded.append((
+                s['title'], snum, last_ep['episodeNumber'], last_ep['title'],
+                air_date.date(), tmdb_id, imdb_id, monitored
+            ))
+    elif air_date > dt.now():
+        downloaded = is_episode_downloaded(last_ep['seasonNumber'], last_ep['episodeNumber'], s['id'], download_index)
+        if downloaded:
+            finales_downloaded.append((
+                s['title'], snum, last_ep['episodeNumber'], last_ep['title'],
+                air_date.date(), tmdb_id, imdb_id, monitored, True
+            ))
 
-        for snum, eps in season_map.items():
-            if not eps:
-                continue
-            last_ep = max(eps, key=lambda x: x['episodeNumber'])
-            air_date_utc = last_ep.get('airDateUtc')
-            if not air_date_utc:
-                continue
+    return finales_downloaded, finales_not_downloaded
 
-            try:
-                air_date = dt.fromisoformat(air_date_utc.rstrip('Z'))
-            except ValueError:
-                print(f"{RED}ERROR: Invalid airDateUtc format for episode '{last_ep.get('title', 'N/A')}' in show '{s.get('title', 'N/A')}'{RESET}")
-                continue
+def get_calendar_candidates(candidates, cutoff_date):
+    """Keep only the series that have an episode in the Sonarr calendar window."""
+    calendar_end = dt.now() + timedelta(days=SONARR_CALENDAR_FUTURE_DAYS)
+    window_series_ids = {e['seriesId'] for e in get_sonarr_calendar(cutoff_date, calendar_end)}
+    return [s for s in candidates if s['id'] in window_series_ids]
 
-            tmdb_id = s.get('tmdbId', 'N/A')
-            imdb_id = s.get('imdbId', 'N/A')
-            monitored = s.get('monitored', False)
-
-            if snum == last_season:
-                if cutoff_date <= air_date <= dt.now():
-                    downloaded = is_episode_downloaded(last_ep['seasonNumber'], last_ep['episodeNumber'], s['id'])
-                    if downloaded:
-                        finales_downloaded.append((
-                            s['title'], snum, last_ep['episodeNumber'], last_ep['title'],
-                            air_date.date(), tmdb_id, imdb_id, monitored
-                        ))
-                    else:
-                        finales_not_downloaded.append((
-                            s['title'], snum, last_ep['episodeNumber'], last_ep['title'],
-                            air_date.date(), tmdb_id, imdb_id, monitored
-                        ))
-                elif air_date > dt.now():
-                    downloaded = is_episode_downloaded(last_ep['seasonNumber'], last_ep['episodeNumber'], s['id'])
-                    if downloaded:
-                        finales_downloaded.append((
-                            s['title'], snum, last_ep['episodeNumber'], last_ep['title'],
-                            air_date.date(), tmdb_id, imdb_id, monitored, True
-                        ))
+def get_recent_finales():
+    cutoff_date = dt.now() - timedelta(days=RECENT_DAYS)
+    finales_downloaded = []
+    finales_not_downloaded = []
+
+    all_series = get_sonarr_series()
+    candidates = [s for s in all_series if not (SKIP_UNMONITORED and not s.get('monitored', True))]
+    if SONARR_PREFILTER_SERIES and SKIP_UNMONITORED:
+        # Skip series whose airing dates rule out a recent or upcoming finale before fetching episodes.
+        # The dates leave out unmonitored episodes, so they can't be trusted when those are included.
+        candidates = [s for s in candidates if series_may_have_finale(s, cutoff_date)]
+
+    if SONARR_MODE == 'calendar':
+        # One calendar call narrows the scan down to the series airing inside the window
+        candidates = get_calendar_candidates(candidates, cutoff_date)
+
+    if SONARR_MAX_WORKERS > 1:
+        # executor.map yields in submission order and re-raises worker errors, like the serial loop
+        with ThreadPoolExecutor(max_workers=SONARR_MAX_WORKERS) as executor:
+            results = list(executor.map(propagate_output(lambda s: evaluate_series(s, cutoff_date)), candidates))
+    else:
+        results = [evaluate_series(s, cutoff_date) for s in candidates]
+
+    for downloaded, not_downloaded in results:
+        finales_downloaded.extend(downloaded)
+        finales_not_downloaded.extend(not_downloaded)
 
     return finales_downloaded, finales_not_downloaded
 
@@ -261,61 +345,27 @@ def get_recent_finales():
 #   Plex Connection   #
 # --------------------#
 def connect_plex():
-    try:
-        plex = PlexServer(PLEX_URL, PLEX_TOKEN)
-        return plex.library.section(PLEX_LIBRARY_TITLE)
-    except Exception as e:
-        print(f"{RED}ERROR: Failed to connect to Plex: {e}{RESET}")
-        sys.exit(1)
+    """Create the Plex context shared by the filtering, labeling and removal steps of this run."""
+    plex_ctx = PlexContext(PLEX_URL, PLEX_TOKEN, PLEX_LIBRARY_TITLE, PLEX_CACHE_GUID_INDEX)
+    plex_ctx.section  # Connect now so connection errors surface before any other Plex work
+    return plex_ctx
+
+def preload_plex(plex_ctx=None):
+    """Connect to Plex (unless a shared context is given) and load everything the filters and labels need."""
+    plex_ctx = plex_ctx or connect_plex()
+    plex_ctx.id_map
+    plex_ctx.skipped_show_keys(SKIP_GENRES, GENRES_TO_SKIP, SKIP_LABELS, LABELS_TO_SKIP)
+    if ONLY_FINALE_UNWATCHED:
+        plex_ctx.season_counters()
+    return plex_ctx
 
-def build_plex_id_map(plex_shows):
-    id_map = {}
-    for show_obj in plex_shows:
-        try:
-            show_obj = show_obj.reload()  # Fetch full show data, including all genres
-        except Exception as e:
-            print(f"{RED}ERROR: Failed to reload show '{show_obj.title}': {e}{RESET}")
-            continue  # Skip this show and proceed with others
-
-        for guid in show_obj.guids:
-            raw_id = guid.id.lower()
-            if raw_id.startswith("imdb://"):
-                imdb_clean = raw_id.split("imdb://", 1)[1].split("?")[0]
-                id_map[("imdb", imdb_clean)] = show_obj
-            elif raw_id.startswith("tmdb://"):
-                tmdb_clean = raw_id.split("tmdb://", 1)[1].split("?")[0]
-                id_map[("tmdb", tmdb_clean)] = show_obj
-
-    return id_map
-
-def get_plex_show_by_ids(imdb_id, tmdb_id, show_map):
-    if imdb_id and str(imdb_id).lower() != "n/a":
-        candidate = ("imdb", str(imdb_id).lower())
-        if candidate in show_map:
-            return show_map[candidate]
-    if tmdb_id and str(tmdb_id).lower() != "n/a":
-        candidate = ("tmdb", str(tmdb_id).lower())
-        if candidate in show_map:
-            return show_map[candidate]
-    return None
-
-def skip_show_for_genre(show_obj, genres_to_skip):
-    show_genres_lower = [genre.tag.lower() for genre in show_obj.genres]
-    skip_genres_lower = [g.lower() for g in genres_to_skip]
-    for sg in skip_genres_lower:
-        if sg in show_genres_lower:
-            return True
-    return False
-
-def skip_show_for_labels(show_obj, labels_to_skip):
-    current_labels = [lab.tag.lower() for lab in show_obj.labels]
-    labels_to_skip_lower = [label.lower() for label in labels_to_skip]
-    for label in labels_to_skip_lower:
-        if label in current_labels:
-            return True
-    return False
-
-def filter_out_plex_genres_and_labels(finales_list, show_map, skip_genres, skip_labels, genres_to_skip, labels_to_skip):
+def skip_show_for_genre(plex_ctx, show_obj, genres_to_skip):
+    return show_obj.ratingKey in plex_ctx.keys_with_tags('genre', genres_to_skip)
+
+def skip_show_for_labels(plex_ctx, show_obj, labels_to_skip):
+    return show_obj.ratingKey in plex_ctx.keys_with_tags('label', labels_to_skip)
+
+def filter_out_plex_genres_and_labels(finales_list, plex_ctx, skip_genres, skip_labels, genres_to_skip, labels_to_skip):
     filtered = []
     for finale in finales_list:
         if len(finale) == 9:
@@ -323,135 +373,199 @@ def filter_out_plex_genres_and_labels(finales_list, show_map, skip_genres, skip_
         elif len(finale) == 8:
             _, snum, enum, _, _, tmdb_id, imdb_id, _ = finale
 
-        plex_show = get_plex_show_by_ids(imdb_id, tmdb_id, show_map)
+        plex_show = plex_ctx.get_show_by_ids(imdb_id, tmdb_id)
         if plex_show:
-            if skip_genres and skip_show_for_genre(plex_show, genres_to_skip):
+            if skip_genres and skip_show_for_genre(plex_ctx, plex_show, genres_to_skip):
                 continue
-            if skip_labels and skip_show_for_labels(plex_show, labels_to_skip):
+            if skip_labels and skip_show_for_labels(plex_ctx, plex_show, labels_to_skip):
                 continue
         filtered.append(finale)
     return filtered
 
-def filter_shows_with_one_unwatched(finales_list, show_map):
-    filtered = []
+def filter_shows_with_one_unwatched(finales_list, plex_ctx):
+    candidates = []
     for finale in finales_list:
         if len(finale) == 9:
             title, snum, enum, ep_title, air_date, tmdb_id, imdb_id, monitored, _ = finale
         elif len(finale) == 8:
             title, snum, enum, ep_title, air_date, tmdb_id, imdb_id, monitored = finale
 
-        plex_show = get_plex_show_by_ids(imdb_id, tmdb_id, show_map)
+        plex_show = plex_ctx.get_show_by_ids(imdb_id, tmdb_id)
         if plex_show:
-            try:
-                # Get the specific season
-                season_obj = plex_show.season(snum)
-                if not season_obj:
-                    continue
-
-                # Get the specific episode
-                try:
-                    finale_ep = season_obj.episode(enum)
-                except Exception:
-                    continue
-
-                # Check if the finale episode is unwatched
-                if finale_ep.isWatched:
-                    continue  # Finale episode is watched, skip
-
-                # Check if all other episodes are watched
-                all_others_watched = all(ep.isWatched for ep in season_obj.episodes() if ep != finale_ep)
-
-                if all_others_watched:
-                    filtered.append(finale)
-            except Exception:
-                continue  # Skip this show silently
+            candidates.append((finale, plex_show, snum, enum))
 
-    return filtered
+    # All candidates are checked at once from the season watch counters
+    only_unwatched = plex_ctx.only_finale_unwatched(
+        (plex_show, snum, enum) for _, plex_show, snum, enum in candidates
+    )
+    return [
+        finale for finale, plex_show, snum, enum in candidates
+        if (plex_show.ratingKey, snum, enum) in only_unwatched
+    ]
 
 # -------------------------------#
 #   Label Add/Remove Functions   #
 # -------------------------------#
-def add_label_to_show(show_obj, label):
-    current_labels = [lab.tag for lab in show_obj.labels]
+def add_label_to_show(label_batch, show_obj, label):
+    current_labels = label_batch.current_labels(show_obj)
     if label in current_labels:
         print(f"{GREEN}={RESET} Label '{label}' already exists for show '{show_obj.title}', skipping.")
         return
-    print(f"{ORANGE}+{RESET} Adding label '{label}' to show '{show_obj.title}'")
-    show_obj.addLabel(label)
-    show_obj.reload()
+    label_batch.add(show_obj, label)
 
-def remove_label_if_present(show_obj, label):
-    current_labels = [lab.tag for lab in show_obj.labels]
+def remove_label_if_present(label_batch, show_obj, label):
+    current_labels = label_batch.current_labels(show_obj)
     if label in current_labels:
-        print(f"{RED}-{RESET} Removing label '{label}' from show '{show_obj.title}'")
-        show_obj.removeLabel(label)
-        show_obj.reload()
-
-def remove_label_from_all_shows(label):
-    plex = PlexServer(PLEX_URL, PLEX_TOKEN)
-    tv_library = plex.library.section(PLEX_LIBRARY_TITLE)
-    shows = tv_library.all()
+        label_batch.remove(show_obj, label)
 
-    for show_obj in shows:
-        if label in [lab.tag for lab in show_obj.labels]:
-            remove_label_if_present(show_obj, label)
+def print_label_outcomes(outcomes):
+    """Report the result of a batched label write per show, failures were already reported."""
+    for show_obj, label, action, success in outcomes:
+        if not success:
+            continue
+        if action == '+':
+            print(f"{ORANGE}+{RESET} Added label '{label}' to show '{show_obj.title}'")
+        else:
+            print(f"{RED}-{RESET} Removed label '{label}' from show '{show_obj.title}'")
 
-def remove_label_only_unmatched(finales_downloaded, label):
-    plex = PlexServer(PLEX_URL, PLEX_TOKEN)
-    tv_library = plex.library.section(PLEX_LIBRARY_TITLE)
-    shows = tv_library.all()
-    show_map = build_plex_id_map(shows)
+def remove_label_from_all_shows(plex_ctx, label_batch, label):
+    # Only the shows carrying the label are touched
+    for show_obj in plex_ctx.snapshot.shows_with_labels([label]):
+        remove_label_if_present(label_batch, show_obj, label)
 
-    matched_shows_set = set()
+def remove_label_only_unmatched(plex_ctx, label_batch, finales_downloaded, label):
+    matched_keys = set()
     for f in finales_downloaded:
         if len(f) == 9:
             _, snum, enum, _, _, tmdb_id, imdb_id, _, _ = f
         elif len(f) == 8:
             _, snum, enum, _, _, tmdb_id, imdb_id, _ = f
-        plex_show = get_plex_show_by_ids(imdb_id, tmdb_id, show_map)
+        plex_show = plex_ctx.get_show_by_ids(imdb_id, tmdb_id)
         if plex_show:
-            matched_shows_set.add(plex_show)
+            matched_keys.add(plex_show.ratingKey)
 
-    for sh in shows:
-        if label in [lab.tag for lab in sh.labels]:
-            if sh not in matched_shows_set:
-                remove_label_if_present(sh, label)
+    for sh in plex_ctx.snapshot.shows_with_labels([label]):
+        if sh.ratingKey not in matched_keys:
+            remove_label_if_present(label_batch, sh, label)
 
-def matched_shows(finales_downloaded, label):
+def matched_shows(plex_ctx, label_batch, finales_downloaded, label):
     """Add label to all matched shows in `finales_downloaded`."""
-    plex = PlexServer(PLEX_URL, PLEX_TOKEN)
-    tv_library = plex.library.section(PLEX_LIBRARY_TITLE)
-    shows = tv_library.all()
-    show_map = build_plex_id_map(shows)
-
     matched = set()
     for f in finales_downloaded:
         if len(f) == 9:
             _, snum, enum, _, _, tmdb_id, imdb_id, _, _ = f
         elif len(f) == 8:
             _, snum, enum, _, _, tmdb_id, imdb_id, _ = f
-        plex_show = get_plex_show_by_ids(imdb_id, tmdb_id, show_map)
+        plex_show = plex_ctx.get_show_by_ids(imdb_id, tmdb_id)
         if plex_show:
             matched.add(plex_show)
 
     for s in matched:
-        add_label_to_show(s, label)
+        add_label_to_show(label_batch, s, label)
 
-def handle_label_logic(finales_downloaded):
+def handle_label_logic(plex_ctx, finales_downloaded):
+    # All adds and removes are collected first and written in as few multi-edit requests as possible.
+    # Labels are tracked in the shared snapshot, so a Trakt run in the same process sees these edits.
+    label_batch = LabelBatch(plex_ctx.section, plex_ctx.snapshot)
     if not LABEL_SERIES_IN_PLEX:
         if REMOVE_LABELS_IF_NO_LONGER_MATCHED:
             # Remove from ALL shows
-            remove_label_from_all_shows(PLEX_LABEL)
+            remove_label_from_all_shows(plex_ctx, label_batch, PLEX_LABEL)
     else:
         # LABEL_SERIES_IN_PLEX == True
-        matched_shows(finales_downloaded, PLEX_LABEL)
+        matched_shows(plex_ctx, label_batch, finales_downloaded, PLEX_LABEL)
         if REMOVE_LABELS_IF_NO_LONGER_MATCHED:
-            remove_label_only_unmatched(finales_downloaded, PLEX_LABEL)
+            remove_label_only_unmatched(plex_ctx, label_batch, finales_downloaded, PLEX_LABEL)
+
+    outcomes = label_batch.apply()
+    print_label_outcomes(outcomes)
+    return outcomes
+
+# ---------------------#
+#  Targeted Relabeling #
+# ---------------------#
+def find_sonarr_series(plex_ctx, shows, source_ids):
+    """
+    Plex ratingKey -> Sonarr series of the given shows. Each series is fetched on its own: by the
+    Sonarr ID a webhook carried, else by the TVDB ID of the show. Only shows without a TVDB GUID
+    fall back to listing every series and matching it like a full run.
+    """
+    series_by_show = {}
+    unmatched = []
+    tvdb_ids = {}
+    for (kind, series_id), show_obj in plex_ctx.id_map_for(shows).items():
+        if kind == "tvdb":
+            tvdb_ids[show_obj.ratingKey] = series_id
+    for show_obj in shows:
+        s = None
+        sonarr_id = (source_ids.get(show_obj.ratingKey) or {}).get('sonarr_id')
+        if sonarr_id:
+            s = get_sonarr_series_by_id(sonarr_id)
+        if s is None and show_obj.ratingKey in tvdb_ids:
+            s = get_sonarr_series_by_tvdb_id(tvdb_ids[show_obj.ratingKey])
+        elif s is None:
+            unmatched.append(show_obj)
+        if s is not None:
+            series_by_show[show_obj.ratingKey] = s
+
+    if unmatched:
+        id_map = plex_ctx.id_map_for(unmatched)
+        for s in get_sonarr_series():
+            plex_show = get_plex_show_by_ids(s.get('imdbId'), s.get('tmdbId'), id_map, s.get('tvdbId'))
+            if plex_show is not None:
+                series_by_show.setdefault(plex_show.ratingKey, s)
+    return series_by_show
+
+def relabel_shows(plex_ctx, shows, source_ids=None):
+    """
+    Re-evaluate the finale of the Sonarr series of a few Plex shows and add or remove PLEX_LABEL on
+    these shows only (webhooks and --relabel). The shows must have been refreshed with
+    plex_ctx.refresh_show(). `source_ids` maps a ratingKey to the IDs its event carried, such as
+    {'sonarr_id': 12}. Returns the label outcomes like LabelBatch.apply().
+    """
+    _episode_files_cache.clear()
+    cutoff_date = dt.now() - timedelta(days=RECENT_DAYS)
+    series_by_show = find_sonarr_series(plex_ctx, shows, source_ids or {})
 
-# -----------------#
-#   TERMINAL RUN   #
-# -----------------#
-if __name__ == "__main__":
+    label_batch = LabelBatch(plex_ctx.section, plex_ctx.snapshot)
+    for show_obj in shows:
+        s = series_by_show.get(show_obj.ratingKey)
+        if s is None:
+            print(f"{ORANGE}'{show_obj.title}' was not found in Sonarr, skipping.{RESET}")
+            continue
+
+        finale = None
+        if not (SKIP_UNMONITORED and not s.get('monitored', True)):
+            finales_downloaded, _ = evaluate_series(s, cutoff_date)
+            finale = finales_downloaded[0] if finales_downloaded else None
+        if finale and plex_ctx.show_is_skipped(show_obj, SKIP_GENRES, GENRES_TO_SKIP, SKIP_LABELS, LABELS_TO_SKIP):
+            finale = None
+        if finale and ONLY_FINALE_UNWATCHED and not plex_ctx.finale_is_only_unwatched(show_obj, finale[1], finale[2]):
+            finale = None
+
+        if finale:
+            title, snum, enum, ep_title, air_date = finale[:5]
+            print(f"{GREEN}Downloaded finale:{RESET} {title}: Season {snum} Episode {enum} '{ep_title}' ({air_date})")
+        else:
+            print(f"{BLUE}No downloaded finale for '{show_obj.title}' in the last {RECENT_DAYS} days.{RESET}")
+
+        if LABEL_SERIES_IN_PLEX and finale:
+            add_label_to_show(label_batch, show_obj, PLEX_LABEL)
+        elif REMOVE_LABELS_IF_NO_LONGER_MATCHED:
+            remove_label_if_present(label_batch, show_obj, PLEX_LABEL)
+
+    outcomes = label_batch.apply()
+    print_label_outcomes(outcomes)
+    return outcomes
+
+# --------------#
+#   METHOD RUN  #
+# --------------#
+def main(plex_ctx=None):
+    """
+    Run the Sonarr method. `plex_ctx` is the Plex context shared by FLFP, a new one is created otherwise.
+    Returns a summary of the run: finales found and labels added/removed.
+    """
     start_time = time.time()
 
     def color_bool_generic(val):
@@ -495,21 +609,18 @@ if __name__ == "__main__":
     print(f"Only Finale Unwatched: {color_bool_only_finale_unwatched()}")
     print("====================\n")
 
-    # Fetch recent finales from Sonarr
-    finales_downloaded, finales_not_downloaded = get_recent_finales()
-
-    # Connect to Plex and build show map
-    plex_section = connect_plex()
-    all_plex_shows = plex_section.all()
-    show_map = build_plex_id_map(all_plex_shows)
+    # Fetch recent finales from Sonarr while the Plex library is loaded, neither depends on the other
+    (finales_downloaded, finales_not_downloaded), plex_ctx = run_concurrently(
+        get_recent_finales, lambda: preload_plex(plex_ctx)
+    )
 
     # If skipping genres or labels, filter out based on genres and labels
     if SKIP_GENRES or SKIP_LABELS:
         filtered_downloaded = filter_out_plex_genres_and_labels(
-            finales_downloaded, show_map, SKIP_GENRES, SKIP_LABELS, GENRES_TO_SKIP, LABELS_TO_SKIP
+            finales_downloaded, plex_ctx, SKIP_GENRES, SKIP_LABELS, GENRES_TO_SKIP, LABELS_TO_SKIP
         )
         filtered_not_downloaded = filter_out_plex_genres_and_labels(
-            finales_not_downloaded, show_map, SKIP_GENRES, SKIP_LABELS, GENRES_TO_SKIP, LABELS_TO_SKIP
+            finales_not_downloaded, plex_ctx, SKIP_GENRES, SKIP_LABELS, GENRES_TO_SKIP, LABELS_TO_SKIP
         )
     else:
         filtered_downloaded = finales_downloaded
@@ -517,8 +628,8 @@ if __name__ == "__main__":
 
     # Apply the new filter if enabled
     if ONLY_FINALE_UNWATCHED:
-        filtered_downloaded = filter_shows_with_one_unwatched(filtered_downloaded, show_map)
-        filtered_not_downloaded = filter_shows_with_one_unwatched(filtered_not_downloaded, show_map)
+        filtered_downloaded = filter_shows_with_one_unwatched(filtered_downloaded, plex_ctx)
+        filtered_not_downloaded = filter_shows_with_one_unwatched(filtered_not_downloaded, plex_ctx)
 
     # Print results
     if not filtered_downloaded and not filtered_not_downloaded:
@@ -565,9 +676,36 @@ if __name__ == "__main__":
     print()
     print("\n=== Label Operations ===")
     # Label logic
-    handle_label_logic(filtered_downloaded)
+    outcomes = handle_label_logic(plex_ctx, filtered_downloaded)
 
     end_time = time.time()
     elapsed_seconds = int(end_time - start_time)  # Truncate decimals
     formatted_duration = str(datetime.timedelta(seconds=elapsed_seconds))
     print(f"Runtime: {formatted_duration}\n")
+
+    return {
+        'finales': len(filtered_downloaded),
+        'added': sum(1 for _, _, action, success in outcomes if success and action == '+'),
+        'removed': sum(1 for _, _, action, success in outcomes if success and action == '-'),
+    }
+
+def run(config=None, plex_ctx=None, buffered=False):
+    """
+    Entry point of the Sonarr method. FLFP hands over its loaded config and shared Plex context;
+    a standalone run loads config.yml and sets up HTTP itself. Output is logged to Logs/Sonarr.
+    Returns the summary of main().
+    """
+    with method_log("Sonarr", buffered):
+        if config is None:
+            config = load_config()
+            http_client.configure(config)
+            if '--no-cache' in sys.argv[1:]:
+                http_client.disable_cache()
+        init(config)
+        return main(plex_ctx)
+
+# -----------------#
+#   TERMINAL RUN   #
+# -----------------#
+if __name__ == "__main__":
+    run()
@@ -1,11 +1,16 @@
 import requests
+import http_client
+from concurrency import run_concurrently
+from cache_store import load_json, save_json
 import os
 import sys
 import yaml
-from plexapi.server import PlexServer
+from plex_context import PlexContext, LabelBatch
+from run_logging import method_log, propagate_output
 from tqdm import tqdm  # For displaying progress bars
 from datetime import datetime, timedelta
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # ANSI color codes
 GREEN = '\033[32m'
@@ -15,39 +20,6 @@ RED = '\033[31m'
 RESET = '\033[0m'
 BOLD = '\033[1m'
 
-# Set up logging
-script_name = os.path.splitext(os.path.basename(__file__))[0]  # Get script name without extension
-logs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Logs", script_name)
-os.makedirs(logs_dir, exist_ok=True)
-log_file = os.path.join(logs_dir, f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-
-class Logger:
-    def __init__(self, log_file):
-        self.terminal = sys.stdout
-        self.log = open(log_file, "a", encoding="utf-8")  # Specify UTF-8 encoding
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-
-    def flush(self):
-        self.terminal.flush()
-        self.log.flush()
-
-sys.stdout = Logger(log_file)
-sys.stderr = Logger(log_file)
-
-# Clean up old logs
-def clean_old_logs():
-    log_files = sorted(
-        [os.path.join(logs_dir, f) for f in os.listdir(logs_dir) if f.startswith("log_")],
-        key=os.path.getmtime
-    )
-    while len(log_files) > 31:
-        os.remove(log_files.pop(0))
-
-clean_old_logs()
-
 # ============================
 # Load Configuration from config.yml
 # ============================
@@ -66,24 +38,53 @@ def load_config():
         print(f"{RED}ERROR: An error occurred while loading config.yml: {e}{RESET}")
         sys.exit(1)
 
-config = load_config()
-
-TRAKT_CLIENT_ID = config['trakt']['client_id']
-TRAKT_CLIENT_SECRET = config['trakt']['client_secret']
-DESIRED_EPISODE_TYPES = config['trakt']['desired_episode_types']
-PLEX_URL = config['plex']['url']
-PLEX_TOKEN = config['plex']['token']
-PLEX_LIBRARY_TITLE = config['plex']['library_title']
-
-RECENT_DAYS = config['general']['recent_days']
-LABEL_SERIES_IN_PLEX = config['general']['label_series_in_plex']
-REMOVE_LABELS_IF_NO_LONGER_MATCHED = config['general']['remove_labels_if_no_longer_matched']
-SKIP_GENRES = config['general']['skip_genres']
-GENRES_TO_SKIP = config['general']['genres_to_skip']
-SKIP_LABELS = config['general']['skip_labels']
-LABELS_TO_SKIP = config['general']['labels_to_skip']
-ONLY_FINALE_UNWATCHED = config['general']['only_finale_unwatched']
+TRAKT_SEASON_CACHE_FILE = "trakt_seasons.json"
+TRAKT_CALENDAR_MAX_DAYS = 33  # Longest window Trakt serves per calendar request
+FINALE_EPISODE_TYPES = {"mid_season_finale", "season_finale", "series_finale"}
+TRAKT_ID_CACHE_FILE = "trakt_ids.json"
+TRAKT_SEARCH_URL = "https://api.trakt.tv/search/show"
 
+def init(config):
+    """
+    Validate the Trakt method settings of a loaded config.yml and apply them to this module.
+    Runs at the start of every run, nothing is read from config.yml on import.
+    """
+    global TRAKT_CLIENT_ID, TRAKT_CLIENT_SECRET, DESIRED_EPISODE_TYPES, PLEX_URL, PLEX_TOKEN
+    global PLEX_LIBRARY_TITLE, PLEX_CACHE_GUID_INDEX, PLEX_VERIFY_LABELS, RECENT_DAYS, LABEL_SERIES_IN_PLEX
+    global REMOVE_LABELS_IF_NO_LONGER_MATCHED, SKIP_GENRES, GENRES_TO_SKIP, SKIP_LABELS, LABELS_TO_SKIP
+    global ONLY_FINALE_UNWATCHED, TRAKT_NEGATIVE_CACHE_DAYS, TRAKT_MAX_WORKERS
+    global TRAKT_SEASON_CACHE_HOURS, TRAKT_AIRING_SEASON_CACHE_HOURS, DESIRED_LABELS, TRAKT_MODE
+    global TRAKT_CALENDAR_FUTURE_DAYS
+
+    TRAKT_CLIENT_ID = config['trakt']['client_id']
+    TRAKT_CLIENT_SECRET = config['trakt']['client_secret']
+    DESIRED_EPISODE_TYPES = config['trakt']['desired_episode_types']
+    PLEX_URL = config['plex']['url']
+    PLEX_TOKEN = config['plex']['token']
+    PLEX_LIBRARY_TITLE = config['plex']['library_title']
+    PLEX_CACHE_GUID_INDEX = config['plex'].get('cache_guid_index', True)
+    PLEX_VERIFY_LABELS = config['plex'].get('verify_labels', False)
+
+    RECENT_DAYS = config['general']['recent_days']
+    LABEL_SERIES_IN_PLEX = config['general']['label_series_in_plex']
+    REMOVE_LABELS_IF_NO_LONGER_MATCHED = config['general']['remove_labels_if_no_longer_matched']
+    SKIP_GENRES = config['general']['skip_genres']
+    GENRES_TO_SKIP = config['general']['genres_to_skip']
+    SKIP_LABELS = config['general']['skip_labels']
+    LABELS_TO_SKIP = config['general']['labels_to_skip']
+    ONLY_FINALE_UNWATCHED = config['general']['only_finale_unwatched']
+    TRAKT_NEGATIVE_CACHE_DAYS = config['trakt'].get('negative_cache_days', 7)
+    TRAKT_MAX_WORKERS = max(1, int(config['trakt'].get('max_workers', 1)))
+    TRAKT_SEASON_CACHE_HOURS = config['trakt'].get('season_cache_hours', 168)
+    TRAKT_AIRING_SEASON_CACHE_HOURS = config['trakt'].get('airing_season_cache_hours', 6)
+    # Plex labels of the episode types, normalized once for every label comparison of the run
+    DESIRED_LABELS = {normalize_plex_label(episode_type) for episode_type in DESIRED_EPISODE_TYPES}
+    TRAKT_MODE = config['trakt'].get('mode', 'library')
+    TRAKT_CALENDAR_FUTURE_DAYS = config['trakt'].get('calendar_future_days', 365)
+
+    if TRAKT_MODE not in ('library', 'calendar'):
+        print(f"{RED}ERROR: Invalid trakt mode '{TRAKT_MODE}' in config.yml. Must be one of: library, calendar{RESET}")
+        sys.exit(1)
 
 # ============================
 # End of Configuration
@@ -94,35 +95,31 @@ def normalize_plex_label(label):
 
 def connect_plex(plex_url, plex_token, library_title):
     """
-    Connects to the Plex server and retrieves the specified library section.
+    Connects to the Plex server and returns the per-run Plex context of the specified library section.
     """
-    try:
-        plex = PlexServer(plex_url, plex_token)
-        library = plex.library.section(library_title)
-        return library, plex
-    except Exception as e:
-        print(f"{RED}Failed to connect to Plex: {e}{RESET}")
-        exit(1)
+    plex_ctx = PlexContext(plex_url, plex_token, library_title, PLEX_CACHE_GUID_INDEX)
+    plex_ctx.section  # Connect now so connection errors surface before any other work
+    return plex_ctx
 
-def get_all_tv_shows(library):
+def get_all_tv_shows(plex_ctx):
     """
-    Retrieves all TV shows from the specified Plex library section.
+    Retrieves all TV shows, with their GUIDs, genres and labels, from the library in paged bulk requests.
     """
     try:
-        shows = library.all()
-        return shows
+        return plex_ctx.shows
     except Exception as e:
         print(f"{RED}Failed to retrieve TV shows from Plex: {e}{RESET}")
         return []
 
-def get_last_episode(show):
+def get_last_episode(show, last_episodes=None):
     """
     Determines the last episode of a TV show based on the highest season and episode numbers.
+    Taken from the library-wide last episode map when given, otherwise fetched for this show only.
     """
-    try:
-        # Reload the show to ensure the latest data is fetched
-        show.reload()
+    if last_episodes is not None:
+        return last_episodes.get(show.ratingKey)
 
+    try:
         # Get all seasons and sort them by season number descending
         seasons = sorted(show.seasons(), key=lambda s: s.index, reverse=True)
         if not seasons:
@@ -144,29 +141,28 @@ def get_last_episode(show):
         print(f"{RED}Failed to get last episode for show '{show.title}': {e}{RESET}")
         return None
 
-def search_trakt_show(show_title, client_id):
-    """
-    Searches for a TV show on Trakt and retrieves its Trakt ID, slug, IMDb ID, and TMDB ID.
-    """
-    search_url = "https://api.trakt.tv/search/show"
-    headers = {
+def trakt_headers(client_id):
+    return {
         "Content-Type": "application/json",
         "trakt-api-version": "2",
         "trakt-api-key": client_id
     }
-    params = {
-        "query": show_title,
-        "limit": 1,  # Fetch the top result
-        "extended": "full"  # Get full details
-    }
 
+def fetch_trakt_show(url, params, client_id, description):
+    """
+    Runs a Trakt show search and returns (show_info, ok). show_info holds the Trakt ID, slug,
+    IMDb ID and TMDB ID of the top result, or None. ok is False when the request itself failed,
+    so callers can tell "not on Trakt" apart from an error.
+    """
     try:
-        response = requests.get(search_url, headers=headers, params=params)
+        response = http_client.get('trakt', url, headers=trakt_headers(client_id), params=params)
+        if response.status_code == 404:
+            return None, True
         response.raise_for_status()
         results = response.json()
 
         if not results:
-            return None
+            return None, True
 
         # Extract the first result
         show = results[0]['show']
@@ -180,127 +176,466 @@ def search_trakt_show(show_title, client_id):
             'slug': slug,
             'imdb_id': imdb_id,
             'tmdb_id': tmdb_id
-        }
+        }, True
 
     except requests.exceptions.HTTPError as http_err:
-        if http_err.response.status_code != 404:
-            print(f"{RED}HTTP error occurred while searching Trakt for '{show_title}': {http_err}{RESET}")
-            print(f"Response Status Code: {http_err.response.status_code}")
-            print(f"Response Body: {http_err.response.text}{RESET}")
+        print(f"{RED}HTTP error occurred while searching Trakt for {description}: {http_err}{RESET}")
+        print(f"Response Status Code: {http_err.response.status_code}")
+        print(f"Response Body: {http_err.response.text}{RESET}")
     except Exception as err:
-        print(f"{RED}An error occurred while searching Trakt for '{show_title}': {err}{RESET}")
+        print(f"{RED}An error occurred while searching Trakt for {description}: {err}{RESET}")
 
-    return None
+    return None, False
+
+def title_search_params(show_title):
+    return {
+        "query": show_title,
+        "limit": 1,  # Fetch the top result
+        "extended": "full"  # Get full details
+    }
 
-def get_episode_details(trakt_identifier, season, episode, client_id):
+def search_trakt_show(show_title, client_id):
     """
-    Retrieves the episode_type and first_aired date of a specific episode from Trakt.
+    Searches for a TV show on Trakt by title and retrieves its Trakt ID, slug, IMDb ID, and TMDB ID.
     """
-    if isinstance(trakt_identifier, int):
-        identifier = trakt_identifier
-    else:
-        identifier = trakt_identifier  # Assuming slug
+    show_info, _ = fetch_trakt_show(TRAKT_SEARCH_URL, title_search_params(show_title), client_id, f"'{show_title}'")
+    return show_info
 
-    api_url = f"https://api.trakt.tv/shows/{identifier}/seasons/{season}/episodes/{episode}"
-    headers = {
-        "Content-Type": "application/json",
-        "trakt-api-version": "2",
-        "trakt-api-key": client_id
-    }
+def external_ids_from_guids(guids):
+    """
+    Extracts (id_type, id) pairs usable for an exact Trakt lookup from Plex GUID strings,
+    in order of preference: IMDb, TMDB, TVDB.
+    """
+    found = {}
+    for guid in guids:
+        scheme, _, value = guid.lower().partition("://")
+        if scheme in ("imdb", "tmdb", "tvdb") and value:
+            found.setdefault(scheme, value.split("?")[0])
+    return [(id_type, found[id_type]) for id_type in ("imdb", "tmdb", "tvdb") if id_type in found]
+
+def resolve_trakt_show(show, guids, id_cache, client_id):
+    """
+    Resolves a Plex show to its Trakt IDs. Uses the persistent cache (keyed by ratingKey) first,
+    then an exact lookup by the show's IMDb/TMDB/TVDB IDs, and only then a title search.
+    Shows that can't be found are remembered for TRAKT_NEGATIVE_CACHE_DAYS.
+    """
+    key = str(show.ratingKey)
+    entry = id_cache.get(key)
+    if entry and entry.get('guids') == guids:
+        if entry.get('show'):
+            return entry['show']
+        if time.time() - entry.get('missed_at', 0) < TRAKT_NEGATIVE_CACHE_DAYS * 86400:
+            return None
+
+    all_ok = True
+    show_info = None
+    for id_type, media_id in external_ids_from_guids(guids):
+        show_info, ok = fetch_trakt_show(
+            f"https://api.trakt.tv/search/{id_type}/{media_id}", {"type": "show"}, client_id,
+            f"'{show.title}' ({id_type} {media_id})"
+        )
+        all_ok = all_ok and ok
+        if show_info:
+            break
+
+    if not show_info:
+        # Fall back to the free-text title search
+        show_info, ok = fetch_trakt_show(TRAKT_SEARCH_URL, title_search_params(show.title), client_id, f"'{show.title}'")
+        all_ok = all_ok and ok
+
+    if show_info:
+        id_cache[key] = {'guids': guids, 'show': show_info}
+    elif all_ok:
+        # Only remember a miss when Trakt actually answered, errors are retried next run
+        id_cache[key] = {'guids': guids, 'missed_at': time.time()}
+    return show_info
+
+def parse_trakt_date(first_aired_str):
+    """
+    Parses a Trakt air date, returns None if it is missing or can't be parsed.
+    """
+    if not first_aired_str:
+        return None
+    # Handle both 'Z' and fractional seconds
+    try:
+        # Example format: '2024-03-21T07:00:00.000Z'
+        return datetime.strptime(first_aired_str, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        try:
+            # Example format without milliseconds: '2024-03-21T07:00:00Z'
+            return datetime.strptime(first_aired_str, "%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            print(f"{RED}Unable to parse date '{first_aired_str}' for Trakt episode.{RESET}")
+            return None
+
+def fetch_trakt_season(trakt_identifier, season, client_id):
+    """
+    Fetches all episodes of a season from Trakt in one request.
+    Returns {episode number (str): [episode_type, first_aired]}, {} if the season isn't on Trakt, or None on errors.
+    """
+    api_url = f"https://api.trakt.tv/shows/{trakt_identifier}/seasons/{season}"
     params = {
-        "extended": "full,images,translations,ratings"
+        "extended": "full"
     }
 
     try:
-        response = requests.get(api_url, headers=headers, params=params)
+        response = http_client.get('trakt', api_url, headers=trakt_headers(client_id), params=params)
         if response.status_code == 404:
-            return None
+            return {}
         response.raise_for_status()
-        episode_details = response.json()
-
-        episode_type = episode_details.get('episode_type')
-        first_aired_str = episode_details.get('first_aired')
-
-        if first_aired_str:
-            # Handle both 'Z' and fractional seconds
-            try:
-                # Example format: '2024-03-21T07:00:00.000Z'
-                first_aired = datetime.strptime(first_aired_str, "%Y-%m-%dT%H:%M:%S.%fZ")
-            except ValueError:
-                try:
-                    # Example format without milliseconds: '2024-03-21T07:00:00Z'
-                    first_aired = datetime.strptime(first_aired_str, "%Y-%m-%dT%H:%M:%SZ")
-                except ValueError:
-                    print(f"{RED}Unable to parse date '{first_aired_str}' for Trakt episode.{RESET}")
-                    first_aired = None
-        else:
-            first_aired = None
-
-        return (episode_type, first_aired)
+        return {
+            str(ep['number']): [ep.get('episode_type'), ep.get('first_aired')]
+            for ep in response.json() if ep.get('number') is not None
+        }
 
     except requests.exceptions.HTTPError as http_err:
-        if http_err.response.status_code != 404:
-            print(f"{RED}HTTP error occurred while fetching episode details from Trakt: {http_err}{RESET}")
-            print(f"Response Status Code: {http_err.response.status_code}")
-            print(f"Response Body: {http_err.response.text}{RESET}")
+        print(f"{RED}HTTP error occurred while fetching season {season} of '{trakt_identifier}' from Trakt: {http_err}{RESET}")
+        print(f"Response Status Code: {http_err.response.status_code}")
+        print(f"Response Body: {http_err.response.text}{RESET}")
     except Exception as err:
-        print(f"{RED}An error occurred while fetching episode details from Trakt: {err}{RESET}")
+        print(f"{RED}An error occurred while fetching season {season} of '{trakt_identifier}' from Trakt: {err}{RESET}")
 
     return None
 
-def add_label_to_show(show, label):
+def season_is_airing(episodes):
     """
-    Adds a label to the given Plex show using the addLabel method.
+    A season is still airing while it is unknown on Trakt or has episodes without an air date or airing in the future.
     """
-    try:
-        # Reload the show to ensure the latest labels are fetched
-        show.reload()
+    if not episodes:
+        return True
+    now = datetime.now()
+    for _, first_aired_str in episodes.values():
+        first_aired = parse_trakt_date(first_aired_str)
+        if not first_aired or first_aired > now:
+            return True
+    return False
+
+def get_season_episodes(trakt_identifier, season, client_id, season_cache, episode=None):
+    """
+    Returns the episodes of a season, from the persistent season cache while its entry is fresh.
+    Seasons that are still airing expire after TRAKT_AIRING_SEASON_CACHE_HOURS, others after TRAKT_SEASON_CACHE_HOURS.
+    A cached season that doesn't know `episode` yet is fetched again.
+    """
+    key = f"{trakt_identifier}/{season}"
+    entry = season_cache.get(key)
+    if entry and (episode is None or str(episode) in entry['episodes']):
+        ttl_hours = TRAKT_AIRING_SEASON_CACHE_HOURS if entry.get('airing') else TRAKT_SEASON_CACHE_HOURS
+        if time.time() - entry.get('fetched_at', 0) < ttl_hours * 3600:
+            return entry['episodes']
+
+    episodes = fetch_trakt_season(trakt_identifier, season, client_id)
+    if episodes is None:
+        return None  # Errors are not cached, the season is fetched again next time
+
+    season_cache[key] = {
+        'fetched_at': time.time(),
+        'airing': season_is_airing(episodes),
+        'episodes': episodes
+    }
+    return episodes
 
-        # Extract label tags as strings
-        existing_labels = [lab.tag for lab in show.labels]
+def get_episode_details(trakt_identifier, season, episode, client_id, season_cache=None):
+    """
+    Retrieves the episode_type and first_aired date of a specific episode from Trakt.
+    Looked up from the whole season, which is fetched once and cached.
+    """
+    if season_cache is None:
+        season_cache = {}
 
-        # Check if the label already exists
-        if label in existing_labels:
-            return False  # Label already exists; do nothing
+    episodes = get_season_episodes(trakt_identifier, season, client_id, season_cache, episode)
+    if not episodes or str(episode) not in episodes:
+        return None
 
-        # Add the label using the addLabel method
-        show.addLabel(label)
-        return True  # Indicate that label was added
+    episode_type, first_aired_str = episodes[str(episode)]
+    return (episode_type, parse_trakt_date(first_aired_str))
 
-    except AttributeError:
-        print(f"{RED}The 'addLabel' method does not exist for show '{show.title}'. Please verify the Plex API version and method availability.{RESET}")
-    except Exception as e:
-        print(f"{RED}Failed to add label '{label}' to show '{show.title}': {e}{RESET}")
+def add_label_to_show(label_batch, show, label):
+    """
+    Queues a label add for the given Plex show. The batch is written once all shows are processed.
+    """
+    # Current labels from the run's snapshot, no reload needed
+    existing_labels = label_batch.current_labels(show)
 
-    return False  # Indicate that label was not added
+    # Check if the label already exists
+    if label in existing_labels:
+        return False  # Label already exists; do nothing
 
-def remove_label_from_show(show, label):
+    label_batch.add(show, label)
+    return True  # Indicate that label was queued
+
+def remove_label_from_show(label_batch, show, label):
     """
-    Removes a label from the given Plex show using the removeLabel method.
+    Queues a label removal for the given Plex show. The batch is written once all shows are processed.
     """
-    try:
-        # Reload the show to ensure the latest labels are fetched
-        show.reload()
+    # Current labels from the run's snapshot, no reload needed
+    existing_labels = label_batch.current_labels(show)
 
-        # Extract label tags as strings
-        existing_labels = [lab.tag for lab in show.labels]
+    # Check if the label exists
+    if label not in existing_labels:
+        return False  # Label does not exist; do nothing
 
-        # Check if the label exists
-        if label not in existing_labels:
-            return False  # Label does not exist; do nothing
+    label_batch.remove(show, label)
+    return True  # Indicate that label removal was queued
 
-        # Remove the label using the removeLabel method
-        show.removeLabel(label)
-        return True  # Indicate that label was removed
+def queue_episode_type_label(label_batch, snapshot, show, label):
+    """
+    Queues `label` for a qualifying show, replacing the labels of the other desired episode types.
+    Returns False if the show already has it.
+    """
+    current_labels = [normalize_plex_label(lab) for lab in snapshot.labels(show)]  # Normalize to Plex capitalization
+    if label in current_labels:
+        return False
+    # Remove any existing labels from DESIRED_EPISODE_TYPES but not the current label
+    for existing_label in current_labels:
+        if existing_label in DESIRED_LABELS and existing_label != label:
+            remove_label_from_show(label_batch, show, existing_label)
+    add_label_to_show(label_batch, show, label)
+    return True
+
+def queue_episode_type_removals(label_batch, snapshot, show):
+    """Queues the removal of every desired episode type label of a show that no longer qualifies."""
+    for label in snapshot.labels(show):
+        if normalize_plex_label(label) in DESIRED_LABELS:
+            remove_label_from_show(label_batch, show, label)
+
+def build_finale_record(show, last_episode, episode_type, first_aired, imdb_id, tmdb_id, cutoff_past):
+    """
+    Returns the qualifying_shows record of a show's last episode, or None if the episode
+    is not a desired episode type or aired before the RECENT_DAYS cutoff.
+    """
+    season_number, episode_number, episode_title = last_episode
 
-    except AttributeError:
-        print(f"{RED}The 'removeLabel' method does not exist for show '{show.title}'. Please verify the Plex API version and method availability.{RESET}")
+    # Validate first_aired
+    if not first_aired:
+        return None
+
+    # Determine if the episode has already aired or will air
+    if first_aired <= datetime.now():
+        # Episode has already aired; check if within RECENT_DAYS
+        if first_aired < cutoff_past:
+            return None  # Skip episodes aired before the cutoff
+        air_status = f"aired on {first_aired.strftime('%Y-%m-%d')}"
+    else:
+        # Episode is scheduled to air in the future; include regardless of days
+        air_status = f"{BLUE}will air on{RESET} {first_aired.strftime('%Y-%m-%d')}"
+
+    # Check if episode_type is one of the desired types
+    if not episode_type or episode_type.lower() not in [etype.lower() for etype in DESIRED_EPISODE_TYPES]:
+        return None
+
+    return {
+        "title": show.title,
+        "season": season_number,
+        "episode": episode_number,
+        "episode_title": episode_title,
+        "episode_type": episode_type,
+        "air_status": air_status,
+        "imdb_id": imdb_id,   # Add IMDb ID
+        "tmdb_id": tmdb_id    # Add TMDB ID
+    }
+
+def evaluate_show(show, guids, last_episodes, id_cache, season_cache, cutoff_past):
+    """
+    Runs the Trakt lookups for one Plex show and returns its finale record if its last episode
+    is a desired episode type that aired within RECENT_DAYS or is still to air, otherwise None.
+    Only reads from Plex, so it is safe to run for several shows at once.
+    """
+    # Get the last episode details
+    last_episode = get_last_episode(show, last_episodes)
+    if not last_episode:
+        return None
+
+    season_number, episode_number, _ = last_episode
+
+    # Resolve the show on Trakt (cached, by external ID first) to get Trakt ID or slug and external IDs
+    trakt_info = resolve_trakt_show(show, guids, id_cache, TRAKT_CLIENT_ID)
+    if not trakt_info:
+        return None
+
+    trakt_slug = trakt_info['slug']
+    imdb_id = trakt_info.get('imdb_id')  # Retrieve IMDb ID
+    tmdb_id = trakt_info.get('tmdb_id')  # Retrieve TMDB ID
+
+    # Fetch episode_type and first_aired from Trakt
+    episode_details = get_episode_details(trakt_slug, season_number, episode_number, TRAKT_CLIENT_ID, season_cache)
+    if not episode_details:
+        return None
+
+    episode_type, first_aired = episode_details
+    return build_finale_record(show, last_episode, episode_type, first_aired, imdb_id, tmdb_id, cutoff_past)
+
+def load_last_episodes(plex_ctx):
+    """The library-wide last episode map, or None when the listing fails and shows are looked up one by one."""
+    try:
+        return plex_ctx.last_episodes()
     except Exception as e:
-        print(f"{RED}Failed to remove label '{label}' from show '{show.title}': {e}{RESET}")
+        print(f"{RED}Failed to list the episodes of the library, falling back to per-show lookups: {e}{RESET}")
+        return None
+
+def find_library_finales(plex_ctx, shows, skipped_keys, cutoff_past):
+    """
+    Library mode: asks Trakt about the last episode of every Plex show.
+    Returns (show, record) pairs in library order.
+    """
+    # Plex ratingKey -> Trakt IDs, persisted between runs
+    trakt_id_cache = load_json(TRAKT_ID_CACHE_FILE, {})
+    # "slug/season" -> episode types and air dates of the season, persisted between runs
+    trakt_season_cache = load_json(TRAKT_SEASON_CACHE_FILE, {})
+
+    # Last episode of every show from one paged episode listing, instead of three requests per show
+    last_episodes = load_last_episodes(plex_ctx)
+
+    # Trakt lookups run on TRAKT_MAX_WORKERS threads, throttled by the shared Trakt rate limiter.
+    # executor.map keeps the library order, so the Plex label edits stay deterministic.
+    def evaluate(show):
+        if show.ratingKey in skipped_keys:
+            return None  # Skip this show
+        return evaluate_show(show, plex_ctx.guids_for(show), last_episodes, trakt_id_cache, trakt_season_cache, cutoff_past)
+
+    if TRAKT_MAX_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=TRAKT_MAX_WORKERS) as executor:
+            results = list(tqdm(executor.map(propagate_output(evaluate), shows), total=len(shows), desc="Processing Shows"))
+    else:
+        results = [evaluate(show) for show in tqdm(shows, desc="Processing Shows")]
+
+    try:
+        save_json(TRAKT_ID_CACHE_FILE, trakt_id_cache)
+        save_json(TRAKT_SEASON_CACHE_FILE, trakt_season_cache)
+    except OSError as e:
+        print(f"{RED}Failed to save the Trakt caches: {e}{RESET}")
 
-    return False  # Indicate that label was not removed
+    return [(show, item) for show, item in zip(shows, results) if item]
 
-def main():
+def get_trakt_calendar(start_date, days, client_id, finales_only):
+    """
+    Retrieves the Trakt show calendar for `days` days from `start_date`, in requests of at most
+    TRAKT_CALENDAR_MAX_DAYS days. Returns None if any request fails.
+    """
+    calendar = "calendars/all/shows/finales" if finales_only else "calendars/all/shows"
+    entries = []
+    offset = 0
+    while offset < days:
+        chunk_days = min(TRAKT_CALENDAR_MAX_DAYS, days - offset)
+        chunk_start = start_date + timedelta(days=offset)
+        api_url = f"https://api.trakt.tv/{calendar}/{chunk_start.strftime('%Y-%m-%d')}/{chunk_days}"
+        try:
+            response = http_client.get('trakt', api_url, headers=trakt_headers(client_id), params={"extended": "full"})
+            response.raise_for_status()
+            entries.extend(response.json())
+        except requests.exceptions.HTTPError as http_err:
+            print(f"{RED}HTTP error occurred while fetching the Trakt calendar: {http_err}{RESET}")
+            print(f"Response Status Code: {http_err.response.status_code}")
+            print(f"Response Body: {http_err.response.text}{RESET}")
+            return None
+        except Exception as err:
+            print(f"{RED}An error occurred while fetching the Trakt calendar: {err}{RESET}")
+            return None
+        offset += chunk_days
+    return entries
+
+def find_calendar_finales(plex_ctx, shows, skipped_keys, cutoff_past):
+    """
+    Calendar mode: pulls the Trakt calendar for the RECENT_DAYS/TRAKT_CALENDAR_FUTURE_DAYS window,
+    keeps the desired episode types and joins them against the Plex IMDb/TMDB/TVDB index.
+    Only matched shows are checked in Plex. Returns (show, record) pairs in library order, or None on errors.
+    """
+    desired_types = {etype.lower() for etype in DESIRED_EPISODE_TYPES}
+    # The finales calendar is much smaller, but only covers the finale episode types
+    finales_only = desired_types <= FINALE_EPISODE_TYPES
+    days = (datetime.now().date() - cutoff_past.date()).days + TRAKT_CALENDAR_FUTURE_DAYS + 1
+    entries = get_trakt_calendar(cutoff_past.date(), days, TRAKT_CLIENT_ID, finales_only)
+    if entries is None:
+        return None
+
+    # Plex ratingKey -> calendar entries of the desired episode types
+    matches = {}
+    for entry in entries:
+        episode = entry.get('episode') or {}
+        if (episode.get('episode_type') or '').lower() not in desired_types:
+            continue
+        ids = (entry.get('show') or {}).get('ids') or {}
+        show = plex_ctx.get_show_by_ids(ids.get('imdb'), ids.get('tmdb'), ids.get('tvdb'))
+        if show is None or show.ratingKey in skipped_keys:
+            continue
+        matches.setdefault(show.ratingKey, []).append(entry)
+
+    print(f"Trakt calendar: {len(entries)} episodes, {len(matches)} matching shows in Plex.")
+
+    finale_candidates = []
+    # Only the few matched shows are looked up, a library-wide episode listing would cost more here
+    for show in tqdm([show for show in shows if show.ratingKey in matches], desc="Processing Shows"):
+        last_episode = get_last_episode(show)
+        if not last_episode:
+            continue
+        season_number, episode_number, _ = last_episode
+
+        # Only a finale that is the last episode in Plex qualifies, like in library mode
+        for entry in matches[show.ratingKey]:
+            episode = entry['episode']
+            if (episode.get('season'), episode.get('number')) != (season_number, episode_number):
+                continue
+            ids = entry['show'].get('ids') or {}
+            record = build_finale_record(
+                show, last_episode, episode.get('episode_type'), parse_trakt_date(entry.get('first_aired')),
+                ids.get('imdb'), ids.get('tmdb'), cutoff_past
+            )
+            if record:
+                finale_candidates.append((show, record))
+            break
+
+    return finale_candidates
+
+def relabel_shows(plex_ctx, shows, source_ids=None):
+    """
+    Re-evaluate the last episode of a few Plex shows on Trakt and update their episode type labels
+    only (webhooks and --relabel). The shows must have been refreshed with plex_ctx.refresh_show().
+    Trakt is looked up by the Plex GUIDs, so `source_ids` is not used.
+    Returns the label outcomes like LabelBatch.apply().
+    """
+    cutoff_past = datetime.now() - timedelta(days=RECENT_DAYS)
+    trakt_id_cache = load_json(TRAKT_ID_CACHE_FILE, {})
+    trakt_season_cache = load_json(TRAKT_SEASON_CACHE_FILE, {})
+    snapshot = plex_ctx.snapshot
+    label_batch = LabelBatch(plex_ctx.section, snapshot)
+
+    for show in shows:
+        item = None
+        if not plex_ctx.show_is_skipped(show, SKIP_GENRES, GENRES_TO_SKIP, SKIP_LABELS, LABELS_TO_SKIP):
+            last_episodes = {show.ratingKey: plex_ctx.last_episode(show)}
+            item = evaluate_show(show, plex_ctx.guids_for(show), last_episodes, trakt_id_cache, trakt_season_cache, cutoff_past)
+        if item and ONLY_FINALE_UNWATCHED and not plex_ctx.finale_is_only_unwatched(show, item['season'], item['episode']):
+            item = None
+
+        if item:
+            print(f"{item['title']}: Season {item['season']} Episode {item['episode']} "
+                  f"'{item['episode_title']}' ({item['episode_type']}) {item['air_status']}")
+        else:
+            print(f"{BLUE}No desired episode type for the last episode of '{show.title}'.{RESET}")
+
+        if item and LABEL_SERIES_IN_PLEX:
+            queue_episode_type_label(label_batch, snapshot, show, normalize_plex_label(item['episode_type']))
+        elif REMOVE_LABELS_IF_NO_LONGER_MATCHED:
+            queue_episode_type_removals(label_batch, snapshot, show)
+
+    try:
+        save_json(TRAKT_ID_CACHE_FILE, trakt_id_cache)
+        save_json(TRAKT_SEASON_CACHE_FILE, trakt_season_cache)
+    except OSError as e:
+        print(f"{RED}Failed to save the Trakt caches: {e}{RESET}")
+
+    outcomes = label_batch.apply()
+    for show, label, action, success in outcomes:
+        if success and action == '+':
+            print(f"{GREEN}+ Added label '{label}' to show '{show.title}'{RESET}")
+        elif success:
+            print(f"{RED}- Removed label '{label}' from show '{show.title}'{RESET}")
+    return outcomes
+
+def main(plex_ctx=None):
+    """
+    Run the Trakt method. `plex_ctx` is the Plex context shared by FLFP, a new one is created otherwise.
+    Returns a summary of the run: finales found and labels added/removed, or None if Trakt could not be read.
+    """
     # Start runtime timer
     start_time = time.time()
 
@@ -308,6 +643,8 @@ def main():
     print("\n=== Configuration ===")
     print(f"Recent Days: {RECENT_DAYS}")
     print(f"Desired Episode Types: {DESIRED_EPISODE_TYPES}")
+    print(f"Trakt Mode: {TRAKT_MODE}")
+    print(f"Trakt Workers: {TRAKT_MAX_WORKERS}")
 
     # Print Skip Genres along with Genres to Skip on the same line
     genre_color = GREEN if SKIP_GENRES else ORANGE
@@ -328,16 +665,13 @@ def main():
     print("====================\n")
 
     # Step 2: Connect to Plex and retrieve the library section
-    library, plex = connect_plex(PLEX_URL, PLEX_TOKEN, PLEX_LIBRARY_TITLE)
-    if not library:
-        print("Cannot proceed without a valid library section.")
-        return
+    plex_ctx = plex_ctx or connect_plex(PLEX_URL, PLEX_TOKEN, PLEX_LIBRARY_TITLE)
 
     # Step 3: Get all TV shows in the Plex library
-    shows = get_all_tv_shows(library)
+    shows = get_all_tv_shows(plex_ctx)
     if not shows:
         print("No TV shows found in the library.")
-        return
+        return {'finales': 0, 'added': 0, 'removed': 0}
 
     print(f"Found {len(shows)} TV shows in the library '{PLEX_LIBRARY_TITLE}'.\n")
 
@@ -349,178 +683,86 @@ def main():
     labels_added = []
     labels_existed = []
     labels_removed = []
-
-    for show in tqdm(shows, desc="Processing Shows"):
-        show_title = show.title
-        # Reload the show to ensure the latest labels and metadata are fetched
-        try:
-            show.reload()
-        except Exception as e:
-            # Optionally log the error or handle it silently
-            continue
-
-        # Apply Skipping Logic
-        if SKIP_GENRES:
-            show_genres = [genre.tag for genre in show.genres] if show.genres else []
-            # Clean genre names by stripping any leading/trailing whitespace
-            show_genres = [genre.strip() for genre in show_genres]
-            if any(genre in GENRES_TO_SKIP for genre in show_genres):
-                continue  # Skip this show
-
-        if SKIP_LABELS:
-            show_labels = [lab.tag for lab in show.labels]
-            if any(label in LABELS_TO_SKIP for label in show_labels):
-                continue  # Skip this show
-
-        # Get the last episode details
-        last_episode = get_last_episode(show)
-        if not last_episode:
-            continue
-
-        season_number, episode_number, episode_title = last_episode
-
-        # Search for the show on Trakt to get Trakt ID or slug and external IDs
-        trakt_info = search_trakt_show(show_title, TRAKT_CLIENT_ID)
-        if not trakt_info:
-            continue
-
-        trakt_id = trakt_info['trakt_id']
-        trakt_slug = trakt_info['slug']
-        imdb_id = trakt_info.get('imdb_id')  # Retrieve IMDb ID
-        tmdb_id = trakt_info.get('tmdb_id')  # Retrieve TMDB ID
-
-        # Fetch episode_type and first_aired from Trakt
-        episode_details = get_episode_details(trakt_slug, season_number, episode_number, TRAKT_CLIENT_ID)
-        if not episode_details:
-            continue
-
-        episode_type, first_aired = episode_details
-
-        # Validate first_aired
-        if not first_aired:
-            continue
-
-        # Determine if the episode has already aired or will air
-        if first_aired <= datetime.now():
-            # Episode has already aired; check if within RECENT_DAYS
-            if first_aired < cutoff_past:
-                continue  # Skip episodes aired before the cutoff
-            air_status = f"aired on {first_aired.strftime('%Y-%m-%d')}"
-        else:
-            # Episode is scheduled to air in the future; include regardless of days
-            air_status = f"{BLUE}will air on{RESET} {first_aired.strftime('%Y-%m-%d')}"
-
-        # Check if episode_type is one of the desired types
-        if episode_type and episode_type.lower() in [etype.lower() for etype in DESIRED_EPISODE_TYPES]:
-            # If ONLY_FINALE_UNWATCHED is True, check if finale is the only unwatched episode in the season
-            if ONLY_FINALE_UNWATCHED:
-                try:
-                    # Get the specific season
-                    season_obj = show.season(season_number)
-                    if not season_obj:
-                        continue
-
-                    # Get the specific episode
-                    try:
-                        finale_ep = season_obj.episode(episode_number)
-                    except Exception:
-                        continue
-
-                    # Check if the finale episode is unwatched
-                    if finale_ep.isWatched:
-                        continue  # Finale episode is watched, skip
-
-                    # Check if all other episodes are watched
-                    all_others_watched = all(ep.isWatched for ep in season_obj.episodes() if ep != finale_ep)
-
-                    if not all_others_watched:
-                        continue  # There are other unwatched episodes, skip
-                except Exception as e:
-                    # Optionally log the error or handle it silently
-                    continue
-
-            # Append to qualifying shows
-            qualifying_shows.append({
-                "title": show_title,
-                "season": season_number,
-                "episode": episode_number,
-                "episode_title": episode_title,
-                "episode_type": episode_type,
-                "air_status": air_status,
-                "imdb_id": imdb_id,   # Add IMDb ID
-                "tmdb_id": tmdb_id    # Add TMDB ID
-            })
-
-            # Apply label to the show if enabled
-            if LABEL_SERIES_IN_PLEX:
-                # Define the label based on episode_type (normalize to Plex case behavior)
-                label = normalize_plex_label(episode_type)
-
-                # Reload the show again to ensure we get the latest labels
-                show.reload()
-
-                # Check if the desired label already exists
-                current_labels = [lab.tag.capitalize() for lab in show.labels]  # Normalize to Plex capitalization
-                if label in current_labels:
-                    labels_existed.append((show_title, label))
-                else:
-                    # Remove any existing labels from DESIRED_EPISODE_TYPES but not the current label
-                    labels_to_remove = [
-                        lab for lab in current_labels
-                        if lab in [normalize_plex_label(etype) for etype in DESIRED_EPISODE_TYPES] and lab != label
-                    ]
-                    for existing_label in labels_to_remove:
-                        removed = remove_label_from_show(show, existing_label)
-                        if removed:
-                            labels_removed.append((show_title, existing_label))
-                    # Add the new label
-                    label_added = add_label_to_show(show, label)
-                    if label_added:
-                        labels_added.append((show_title, label))
-        # Optional: To prevent hitting Trakt rate limits, add a short delay
-        time.sleep(0.5)  # Sleep for 0.5 seconds
-
+    # Label edits are collected here and written in a few multi-edit requests after Step 6.
+    # Every label decision is taken from the snapshot of the library listing, which is updated after the writes.
+    snapshot = plex_ctx.snapshot
+    label_batch = LabelBatch(plex_ctx.section, snapshot)
+
+    # Skipped genres and labels are resolved by Plex searches instead of checking every show
+    def load_skipped_keys():
+        return plex_ctx.skipped_show_keys(SKIP_GENRES, GENRES_TO_SKIP, SKIP_LABELS, LABELS_TO_SKIP)
+
+    # Plex reads that don't depend on each other run at the same time
+    preload = load_last_episodes if TRAKT_MODE == 'library' else (lambda ctx: ctx.id_map)
+    skipped_keys, _ = run_concurrently(load_skipped_keys, lambda: preload(plex_ctx))
+
+    if TRAKT_MODE == 'calendar':
+        finale_candidates = find_calendar_finales(plex_ctx, shows, skipped_keys, cutoff_past)
+        if finale_candidates is None:
+            print(f"{RED}Could not retrieve the Trakt calendar. No labels were changed.{RESET}")
+            return None
+    else:
+        finale_candidates = find_library_finales(plex_ctx, shows, skipped_keys, cutoff_past)
+
+    # If ONLY_FINALE_UNWATCHED is True, keep finales that are the only unwatched episode in their season.
+    # Evaluated for all candidates at once from the season watch counters.
+    if ONLY_FINALE_UNWATCHED:
+        only_unwatched = plex_ctx.only_finale_unwatched(
+            (show, item['season'], item['episode']) for show, item in finale_candidates
+        )
+        finale_candidates = [
+            (show, item) for show, item in finale_candidates
+            if (show.ratingKey, item['season'], item['episode']) in only_unwatched
+        ]
+
+    for show, item in finale_candidates:
+        show_title = item['title']
+        episode_type = item['episode_type']
+
+        # Append to qualifying shows
+        qualifying_shows.append(item)
+
+        # Apply label to the show if enabled
+        if LABEL_SERIES_IN_PLEX:
+            # Define the label based on episode_type (normalize to Plex case behavior)
+            label = normalize_plex_label(episode_type)
+            if not queue_episode_type_label(label_batch, snapshot, show, label):
+                labels_existed.append((show_title, label))
 
     # Step 6: Remove labels from shows if configured to do so
     if REMOVE_LABELS_IF_NO_LONGER_MATCHED:
         try:
+            # Only the shows carrying one of the episode type labels are checked
+            labeled_shows = snapshot.shows_with_labels(DESIRED_LABELS)
+
             # If LABEL_SERIES_IN_PLEX is False, remove all labels in DESIRED_EPISODE_TYPES from all shows
             if not LABEL_SERIES_IN_PLEX:
-                for show in shows:
-                    show.reload()  # Ensure we have the latest metadata
-                    current_labels = [lab.tag for lab in show.labels]
-                    labels_to_remove = [
-                        lab for lab in current_labels
-                        if normalize_plex_label(lab) in [normalize_plex_label(etype) for etype in DESIRED_EPISODE_TYPES]
-                    ]
-                    for label in labels_to_remove:
-                        try:
-                            removed = remove_label_from_show(show, label)
-                            if removed:
-                                labels_removed.append((show.title, label))
-                        except Exception as e:
-                            print(f"{RED}Error removing label '{label}' from show '{show.title}': {e}{RESET}")
+                for show in labeled_shows:
+                    queue_episode_type_removals(label_batch, snapshot, show)
             else:
                 # Standard logic: Remove outdated labels for non-qualifying shows
-                qualifying_show_titles = set([show['title'] for show in qualifying_shows])
-                for show in shows:
-                    show.reload()  # Ensure we have the latest metadata
-                    current_labels = [lab.tag for lab in show.labels]
-                    labels_to_remove = [
-                        lab for lab in current_labels
-                        if normalize_plex_label(lab) in [normalize_plex_label(etype) for etype in DESIRED_EPISODE_TYPES]
-                        and show.title not in qualifying_show_titles
-                    ]
-                    for label in labels_to_remove:
-                        try:
-                            removed = remove_label_from_show(show, label)
-                            if removed:
-                                labels_removed.append((show.title, label))
-                        except Exception as e:
-                            print(f"{RED}Error removing label '{label}' from show '{show.title}': {e}{RESET}")
+                qualifying_keys = {show.ratingKey for show, _ in finale_candidates}
+                for show in labeled_shows:
+                    if show.ratingKey in qualifying_keys:
+                        continue
+                    queue_episode_type_removals(label_batch, snapshot, show)
         except Exception as e:
             print(f"{RED}An error occurred while removing outdated labels: {e}{RESET}")
 
+    # Write all collected label edits in as few requests as possible
+    outcomes = label_batch.apply()
+    for show, label, action, success in outcomes:
+        if not success:
+            continue  # Already reported by the batch
+        if action == '+':
+            labels_added.append((show.title, label))
+        else:
+            labels_removed.append((show.title, label))
+
+    if PLEX_VERIFY_LABELS and outcomes:
+        # Optional read-back of every show we wrote to
+        snapshot.verify({show.ratingKey: show for show, _, _, success in outcomes if success}.values())
+
     # Step 7: Display the qualifying shows
     if qualifying_shows:
         print(f"\n{GREEN}=== Qualifying TV Shows with Finale Episodes === {RESET}")
@@ -560,5 +802,22 @@ def main():
     minutes, seconds = divmod(remainder, 60)
     print(f"Runtime: {hours:02}:{minutes:02}:{seconds:02}")
 
+    return {'finales': len(qualifying_shows), 'added': len(labels_added), 'removed': len(labels_removed)}
+
+def run(config=None, plex_ctx=None, buffered=False):
+    """
+    Entry point of the Trakt method. FLFP hands over its loaded config and shared Plex context;
+    a standalone run loads config.yml and sets up HTTP itself. Output is logged to Logs/Trakt.
+    Returns the summary of main().
+    """
+    with method_log("Trakt", buffered):
+        if config is None:
+            config = load_config()
+            http_client.configure(config)
+            if '--no-cache' in sys.argv[1:]:
+                http_client.disable_cache()
+        init(config)
+        return main(plex_ctx)
+
 if __name__ == "__main__":
-        main()
+    run()
@@ -0,0 +1,29 @@
+import json
+import os
+import threading
+
+# Persistent caches live next to the Logs folder
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Cache")
+
+_lock = threading.Lock()
+
+def cache_path(name):
+    return os.path.join(CACHE_DIR, name)
+
+def load_json(name, default=None):
+    """Load a JSON cache file, returning `default` if it is missing or unreadable."""
+    try:
+        with open(cache_path(name), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError, OSError):
+        return default
+
+def save_json(name, data):
+    """Write a JSON cache file atomically, so an interrupted run never leaves a corrupt cache."""
+    path = cache_path(name)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
@@ -0,0 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+from run_logging import propagate_output
+
+def run_concurrently(*funcs):
+    """
+    Call independent blocking functions at the same time, each on its own thread, and return their
+    results in order. The threads write to the log of the caller; errors are re-raised here.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(funcs))) as executor:
+        futures = [executor.submit(propagate_output(func)) for func in funcs]
+        return [future.result() for future in futures]
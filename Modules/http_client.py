@@ -0,0 +1,213 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rate_limit import RateLimiter
+from response_cache import ResponseCache
+
+# Per-service defaults, overridable through the `http` section of config.yml
+DEFAULT_TIMEOUTS = {
+    'sonarr': 30,
+    'trakt': 15,
+    'github': 5,
+}
+DEFAULT_TIMEOUT = 30
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Services behind a shared token bucket: (requests per second, burst). Trakt allows 1000 GETs per 5 minutes.
+DEFAULT_RATE_LIMITS = {
+    'trakt': (1000 / 300, 10),
+}
+
+# Seconds a response is served from the disk cache, by "service:URL path fragment".
+# The longest matching fragment wins, endpoints without a match are never cached. A TTL of 0
+# keeps the response but checks it with the server on every request, so it is never stale.
+# Sonarr download state must be current on every run, and Trakt searches and seasons already
+# have their own caches (negative_cache_days, season_cache_hours), which a TTL here would outlast.
+DEFAULT_CACHE_TTLS = {
+    'sonarr:/series': 0,
+    'sonarr:/episode': 0,  # Also covers /episodefile
+    'trakt:/search/': 0,
+    'trakt:/shows/': 0,
+    'trakt:/calendars/': 3600,
+}
+DEFAULT_CACHE_MAX_MB = 100
+
+_settings = {
+    'timeouts': dict(DEFAULT_TIMEOUTS),
+    'retries': 3,
+    'backoff_factor': 0.5,
+    'pool_size': 16,
+    'max_per_host': None,  # Defaults to pool_size
+    'cache_enabled': True,
+    'cache_ttls': dict(DEFAULT_CACHE_TTLS),
+    'cache_max_mb': DEFAULT_CACHE_MAX_MB,
+}
+_sessions = {}
+_limiters = {}
+_response_cache = None
+_host_slots = {}
+_lock = threading.Lock()
+# Set inside revalidate(): cached responses are checked with the server even while fresh
+_revalidate = contextvars.ContextVar('revalidate', default=False)
+
+def configure(config):
+    """Apply the optional `http` section of config.yml. Must run before the first request."""
+    http_config = (config or {}).get('http') or {}
+    with _lock:
+        _settings['timeouts'].update(http_config.get('timeouts') or {})
+        for key in ('retries', 'backoff_factor', 'pool_size', 'max_per_host'):
+            if http_config.get(key) is not None:
+                _settings[key] = http_config[key]
+        cache_config = http_config.get('cache') or {}
+        if cache_config.get('enabled') is not None:
+            _settings['cache_enabled'] = cache_config['enabled']
+        _settings['cache_ttls'].update(cache_config.get('ttls') or {})
+        if cache_config.get('max_size_mb') is not None:
+            _settings['cache_max_mb'] = cache_config['max_size_mb']
+
+def disable_cache():
+    """Bypass the response cache for this run (the --no-cache option)."""
+    _settings['cache_enabled'] = False
+
+@contextmanager
+def revalidate():
+    """
+    Check cached responses with the server for every GET inside this block, for targeted runs that
+    must see changes made seconds ago. Unchanged responses still cost only a 304.
+    """
+    token = _revalidate.set(True)
+    try:
+        yield
+    finally:
+        _revalidate.reset(token)
+
+def get_timeout(service):
+    return _settings['timeouts'].get(service, DEFAULT_TIMEOUT)
+
+def _build_session(status_forcelist):
+    retry = Retry(
+        total=_settings['retries'],
+        backoff_factor=_settings['backoff_factor'],
+        status_forcelist=status_forcelist,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # Hand the last response back so callers keep their status handling
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry,
+        pool_connections=_settings['pool_size'],
+        pool_maxsize=_settings['pool_size'],
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+def get_session(service):
+    """Return the keep-alive session of a service, creating it on first use."""
+    session = _sessions.get(service)
+    if session is None:
+        with _lock:
+            session = _sessions.get(service)
+            if session is None:
+                # Rate limited services handle 429 themselves so the shared bucket sees it
+                status_forcelist = RETRY_STATUS_CODES
+                if service in DEFAULT_RATE_LIMITS:
+                    status_forcelist = tuple(code for code in RETRY_STATUS_CODES if code != 429)
+                session = _sessions[service] = _build_session(status_forcelist)
+    return session
+
+def get_rate_limiter(service):
+    """Return the shared rate limiter of a service, or None if the service isn't rate limited."""
+    if service not in DEFAULT_RATE_LIMITS:
+        return None
+    limiter = _limiters.get(service)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(service)
+            if limiter is None:
+                limiter = _limiters[service] = RateLimiter(*DEFAULT_RATE_LIMITS[service])
+    return limiter
+
+def get_cache_ttl(service, url):
+    """Seconds a response of this URL is served without asking the server, None if it is not cached at all."""
+    if not _settings['cache_enabled']:
+        return None
+    path = urlparse(url).path
+    matches = [
+        (len(rule), ttl) for rule, ttl in _settings['cache_ttls'].items()
+        if rule.partition(':')[0] == service and rule.partition(':')[2] in path
+    ]
+    return max(matches)[1] if matches else None
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        with _lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(_settings['cache_max_mb'] * 1024 * 1024)
+    return _response_cache
+
+def get(service, url, **kwargs):
+    """
+    GET through the pooled session of `service`, using its default timeout unless one is given.
+    Responses of endpoints with a cache TTL are served from the disk cache while fresh and revalidated once stale.
+    """
+    kwargs.setdefault('timeout', get_timeout(service))
+    ttl = get_cache_ttl(service, url)
+    if ttl is None:
+        return _send(service, url, **kwargs)
+
+    cache = get_response_cache()
+    key = cache.key(service, url, kwargs.get('params'))
+    entry = cache.load(key)
+    if entry and cache.is_fresh(entry, ttl) and not _revalidate.get():
+        return cache.to_response(entry, url)
+
+    if entry:
+        kwargs['headers'] = {**(kwargs.get('headers') or {}), **cache.conditional_headers(entry)}
+    response = _send(service, url, **kwargs)
+    if entry and response.status_code == 304:
+        cache.renew(key, entry)
+        return cache.to_response(entry, url)
+    # With a TTL of 0 an entry only pays off if the server can answer 304 for it
+    if response.status_code == 200 and (ttl or 'ETag' in response.headers or 'Last-Modified' in response.headers):
+        cache.store(key, response)
+    return response
+
+def _host_slot(url):
+    """Semaphore capping the requests in flight to one host, shared by every worker thread and coroutine."""
+    host = urlparse(url).netloc
+    slot = _host_slots.get(host)
+    if slot is None:
+        with _lock:
+            slot = _host_slots.get(host)
+            if slot is None:
+                slot = _host_slots[host] = threading.BoundedSemaphore(_settings['max_per_host'] or _settings['pool_size'])
+    return slot
+
+def _send(service, url, **kwargs):
+    limiter = get_rate_limiter(service)
+    if limiter is None:
+        with _host_slot(url):
+            return get_session(service).get(url, **kwargs)
+
+    # Only requests that actually go out wait for a token; 429s pause the whole bucket and are retried
+    for _ in range(_settings['retries'] + 1):
+        limiter.acquire()
+        with _host_slot(url):
+            response = get_session(service).get(url, **kwargs)
+        limiter.update_from_response(response)
+        if response.status_code != 429:
+            break
+    return response
+
+def close_all():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,656 @@
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from cache_store import load_json, save_json
+
+try:
+    from plexapi.server import PlexServer
+    from plexapi.exceptions import NotFound
+except ImportError:
+    print("ERROR: python-plexapi is not installed. Run: pip install plexapi")
+    sys.exit(1)
+
+# ANSI color codes
+RED = '\033[31m'
+RESET = '\033[0m'
+
+# Shows per paged listing request when hydrating the library
+HYDRATE_PAGE_SIZE = 1000
+# Shows per multi-item edit request, keeps the request URL at a sane length
+MULTI_EDIT_CHUNK_SIZE = 100
+# Shows per /library/metadata request when fetching the GUIDs of new or changed shows
+GUID_FETCH_CHUNK_SIZE = 100
+GUID_INDEX_FILE = "plex_guid_index.json"
+# Changed shows whose episodes are listed one by one on a warm context; with more, one library-wide pass is cheaper
+INCREMENTAL_EPISODE_LIMIT = 50
+# Seconds a listing loaded for targeted lookups is trusted; a listener runs for days and must notice re-matched or deleted shows
+LISTING_MAX_AGE = 3600
+
+def fetch_shows(section, page_size=HYDRATE_PAGE_SIZE, include_guids=True):
+    """
+    List every show of the section in paged bulk requests. The listing includes GUIDs,
+    genres and labels, so the shows don't need a reload() to be indexed or filtered.
+    """
+    return section.search(libtype='show', includeGuids=include_guids, container_size=page_size)
+
+def bulk_attr(plex_obj, attr):
+    """Read a list attribute as loaded by the bulk listing, without triggering plexapi's auto reload."""
+    return plex_obj.__dict__.get(attr) or []
+
+def bulk_tags(plex_obj, attr):
+    """Tag strings (e.g. of 'labels' or 'genres') as loaded by the bulk listing."""
+    return [tag.tag for tag in bulk_attr(plex_obj, attr)]
+
+def _timestamp(value):
+    return int(value.timestamp()) if value else None
+
+def _episode_stamp(show):
+    """Changes whenever episodes of the show are added, removed or (un)watched."""
+    data = show.__dict__
+    return (data.get('leafCount'), data.get('viewedLeafCount'), _timestamp(data.get('updatedAt')))
+
+def _reduce_episodes(episodes, per_show):
+    """
+    Fold episodes into per_show: show ratingKey -> [last (season, episode, title), {season: unwatched episode numbers}].
+    Reads the attributes of the listing only, so no episode is reloaded.
+    """
+    for episode in episodes:
+        data = episode.__dict__
+        show_key, season, number = data.get('grandparentRatingKey'), data.get('parentIndex'), data.get('index')
+        if season is None or number is None:
+            continue
+        entry = per_show.setdefault(show_key, [None, {}])
+        if entry[0] is None or (season, number) > entry[0][:2]:
+            entry[0] = (season, number, data.get('title'))
+        if not data.get('viewCount'):
+            entry[1].setdefault(season, set()).add(number)
+
+def refresh_guid_index(server, shows, cached_items):
+    """
+    Bring the persisted ratingKey -> GUIDs index up to date with the current show listing.
+    Entries whose updatedAt/addedAt are unchanged are reused, GUIDs are fetched in bulk only for
+    new or changed shows, and shows that are no longer in the library are dropped.
+    """
+    items = {}
+    stale = {}
+    for show in shows:
+        key = str(show.ratingKey)
+        stamp = [_timestamp(show.__dict__.get('updatedAt')), _timestamp(show.__dict__.get('addedAt'))]
+        listed_guids = bulk_attr(show, 'guids')
+        cached = cached_items.get(key)
+        if listed_guids:
+            items[key] = {'stamp': stamp, 'guids': [guid.id for guid in listed_guids]}
+        elif cached and cached.get('stamp') == stamp:
+            items[key] = cached
+        else:
+            stale[key] = stamp
+
+    stale_keys = list(stale)
+    for i in range(0, len(stale_keys), GUID_FETCH_CHUNK_SIZE):
+        chunk = stale_keys[i:i + GUID_FETCH_CHUNK_SIZE]
+        try:
+            fetched = server.fetchItems(f"/library/metadata/{','.join(chunk)}?includeGuids=1")
+        except Exception as e:
+            # Left out of the index, so these shows are retried on the next run
+            print(f"{RED}ERROR: Failed to fetch GUIDs for {len(chunk)} show(s) from Plex: {e}{RESET}")
+            continue
+        for item in fetched:
+            key = str(item.ratingKey)
+            if key in stale:
+                items[key] = {'stamp': stale[key], 'guids': [guid.id for guid in bulk_attr(item, 'guids')]}
+
+    return items
+
+def build_plex_id_map(plex_shows, guid_index=None):
+    id_map = {}
+    for show_obj in plex_shows:
+        if guid_index is not None:
+            # GUIDs from the persistent index, shows missing from it could not be fetched
+            _add_guids_to_id_map(id_map, guid_index.get(str(show_obj.ratingKey), []), show_obj)
+            continue
+
+        guids = bulk_attr(show_obj, 'guids')
+        if not guids:
+            # Only shows the bulk listing returned without GUIDs need a reload
+            try:
+                show_obj.reload()
+                guids = show_obj.guids
+            except Exception as e:
+                print(f"{RED}ERROR: Failed to reload show '{show_obj.title}': {e}{RESET}")
+                continue  # Skip this show and proceed with others
+
+        _add_guids_to_id_map(id_map, [guid.id for guid in guids], show_obj)
+
+    return id_map
+
+def _add_guids_to_id_map(id_map, guid_ids, show_obj):
+    for guid_id in guid_ids:
+        raw_id = guid_id.lower()
+        if raw_id.startswith("imdb://"):
+            imdb_clean = raw_id.split("imdb://", 1)[1].split("?")[0]
+            id_map[("imdb", imdb_clean)] = show_obj
+        elif raw_id.startswith("tmdb://"):
+            tmdb_clean = raw_id.split("tmdb://", 1)[1].split("?")[0]
+            id_map[("tmdb", tmdb_clean)] = show_obj
+        elif raw_id.startswith("tvdb://"):
+            tvdb_clean = raw_id.split("tvdb://", 1)[1].split("?")[0]
+            id_map[("tvdb", tvdb_clean)] = show_obj
+
+def get_plex_show_by_ids(imdb_id, tmdb_id, show_map, tvdb_id=None):
+    if imdb_id and str(imdb_id).lower() != "n/a":
+        candidate = ("imdb", str(imdb_id).lower())
+        if candidate in show_map:
+            return show_map[candidate]
+    if tmdb_id and str(tmdb_id).lower() != "n/a":
+        candidate = ("tmdb", str(tmdb_id).lower())
+        if candidate in show_map:
+            return show_map[candidate]
+    if tvdb_id and str(tvdb_id).lower() != "n/a":
+        candidate = ("tvdb", str(tvdb_id).lower())
+        if candidate in show_map:
+            return show_map[candidate]
+    return None
+
+class PlexContext:
+    """
+    Per-run Plex state: the server connection, the show list of the TV library and the
+    IMDb/TMDB/TVDB -> show index. Each piece is loaded on first use and shared by every step of the run.
+    """
+    def __init__(self, plex_url, plex_token, library_title, cache_guid_index=True):
+        self.plex_url = plex_url
+        self.plex_token = plex_token
+        self.library_title = library_title
+        self.cache_guid_index = cache_guid_index
+        self._server = None
+        self._section = None
+        self._shows = None
+        self._guid_index = None
+        self._id_map = None
+        self._tag_searches = {}
+        self._season_counters = None
+        self._unwatched_episodes = None
+        self._snapshot = None
+        self._last_episodes = None
+        self._listed_at = None
+        # Kept across cycles (see new_cycle): GUID index entries and the episodes of every show
+        self._guid_items = None
+        self._episode_cache = {}
+
+    def new_cycle(self):
+        """
+        Prepare the context for another run in the same process (daemon mode). The connection, the
+        GUID index and the episode data of unchanged shows are kept, everything that reflects the
+        current state of the library is listed again on first use.
+        """
+        self._shows = None
+        self._id_map = None
+        self._snapshot = None
+        self._tag_searches = {}
+        self._season_counters = None
+        self._unwatched_episodes = None
+        self._last_episodes = None
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._connect()
+        return self._server
+
+    @property
+    def section(self):
+        if self._section is None:
+            self._connect()
+        return self._section
+
+    def _connect(self):
+        try:
+            self._server = PlexServer(self.plex_url, self.plex_token)
+            self._section = self._server.library.section(self.library_title)
+        except Exception as e:
+            print(f"{RED}ERROR: Failed to connect to Plex: {e}{RESET}")
+            sys.exit(1)
+
+    @property
+    def shows(self):
+        if self._shows is None:
+            self._load_shows()
+        return self._shows
+
+    def _load_shows(self):
+        self._listed_at = time.monotonic()
+        if not self.cache_guid_index:
+            self._shows = fetch_shows(self.section)
+            return
+
+        # A warm index lets the listing skip GUIDs, only new or changed shows get theirs fetched
+        cached_items = self._guid_items
+        if cached_items is None:
+            cache = load_json(GUID_INDEX_FILE, {})
+            cached_items = cache.get('items', {}) if cache.get('section') == self.section.uuid else {}
+        self._shows = fetch_shows(self.section, include_guids=not cached_items)
+        items = refresh_guid_index(self.server, self._shows, cached_items)
+        self._guid_index = {key: entry['guids'] for key, entry in items.items()}
+        if items != self._guid_items:
+            try:
+                save_json(GUID_INDEX_FILE, {'section': self.section.uuid, 'items': items})
+            except OSError as e:
+                print(f"{RED}ERROR: Failed to save the Plex GUID index: {e}{RESET}")
+        self._guid_items = items
+
+    @property
+    def guid_index(self):
+        """ratingKey (str) -> GUID strings ('imdb://tt..', 'tmdb://..', 'tvdb://..'), None when not cached."""
+        self.shows
+        return self._guid_index
+
+    def guids_for(self, show_obj):
+        """
+        GUID strings of a show, from the persistent index when the library is listed and the index
+        enabled, or else from the show itself (the bulk listing, or its reload by refresh_show()).
+        """
+        if self._shows is not None and self._guid_index is not None and str(show_obj.ratingKey) in self._guid_index:
+            return self._guid_index[str(show_obj.ratingKey)]
+        return [guid.id for guid in bulk_attr(show_obj, 'guids')]
+
+    def id_map_for(self, show_objs):
+        """IMDb/TMDB/TVDB -> show index of just the given shows, for get_plex_show_by_ids()."""
+        id_map = {}
+        for show_obj in show_objs:
+            _add_guids_to_id_map(id_map, self.guids_for(show_obj), show_obj)
+        return id_map
+
+    @property
+    def snapshot(self):
+        """Per-run label snapshot of the library, see ShowSnapshot."""
+        if self._snapshot is None:
+            self._snapshot = ShowSnapshot(self.shows)
+        return self._snapshot
+
+    @property
+    def id_map(self):
+        if self._id_map is None:
+            self._id_map = build_plex_id_map(self.shows, self.guid_index)
+        return self._id_map
+
+    def get_show_by_ids(self, imdb_id, tmdb_id, tvdb_id=None):
+        return get_plex_show_by_ids(imdb_id, tmdb_id, self.id_map, tvdb_id)
+
+    def find_show(self, imdb_id=None, tmdb_id=None, tvdb_id=None, rating_key=None):
+        """
+        Resolve one show of the library for targeted relabeling, by ratingKey or by IMDb/TMDB/TVDB ID,
+        without listing the library: the item is fetched by its ratingKey, or looked up with a GUID
+        search. An already loaded listing younger than LISTING_MAX_AGE answers ID lookups for free,
+        and the listing is only loaded when the GUID search isn't supported by the library's agent.
+        Returns None if the show isn't in the library.
+        """
+        if rating_key:
+            try:
+                item = self.server.fetchItem(int(rating_key))
+            except Exception:
+                return None
+            if item.TYPE == 'show' and str(item.librarySectionID) == str(self.section.key):
+                return item
+            return None
+
+        if self._listed_at is not None and time.monotonic() - self._listed_at > LISTING_MAX_AGE:
+            self.new_cycle()
+        if self._shows is not None:
+            show_obj = self.get_show_by_ids(imdb_id, tmdb_id, tvdb_id)
+            if show_obj is not None:
+                return show_obj
+
+        show_obj, searched = self._find_show_by_guid(imdb_id, tmdb_id, tvdb_id)
+        if show_obj is None and not searched:
+            show_obj = self.get_show_by_ids(imdb_id, tmdb_id, tvdb_id)
+        return show_obj
+
+    def _find_show_by_guid(self, imdb_id, tmdb_id, tvdb_id):
+        """
+        Ask Plex for a show by its external IDs, one at a time. Returns (show or None, searched),
+        searched is False when no GUID search could be completed (e.g. a legacy agent).
+        """
+        searched = False
+        for prefix, series_id in (('imdb', imdb_id), ('tmdb', tmdb_id), ('tvdb', tvdb_id)):
+            if not series_id or str(series_id).lower() == "n/a":
+                continue
+            try:
+                item = self.section.getGuid(f"{prefix}://{series_id}")
+            except NotFound:
+                searched = True
+                continue
+            except Exception:
+                continue  # The library's agent can't match external IDs
+            if item.TYPE == 'show':
+                if self._id_map is not None:
+                    self._id_map[(prefix, str(series_id).lower())] = item
+                return item, True
+            searched = True
+        return None, searched
+
+    def refresh_show(self, show_obj):
+        """
+        Reload one show and list its episodes, for targeted relabeling: two requests instead of the
+        library-wide listings. Updates the snapshot labels and the episode data of the show, see
+        last_episode() and finale_is_only_unwatched(). Library-wide memos of the cycle are left as they are.
+        Without a loaded snapshot, one is started that holds only the refreshed shows, so a targeted
+        context never lists the library for its labels; run new_cycle() before using it for a full run.
+        """
+        if self._snapshot is None:
+            self._snapshot = ShowSnapshot([])
+        self._snapshot.shows.setdefault(show_obj.ratingKey, show_obj)
+        self._snapshot.refresh(show_obj)
+        key = show_obj.ratingKey
+        per_show = {key: [None, {}]}
+        _reduce_episodes(self.server.fetchItems(f"/library/metadata/{key}/allLeaves"), per_show)
+        self._episode_cache[key] = (_episode_stamp(show_obj), per_show[key])
+
+    def last_episode(self, show_obj):
+        """(season, episode, title) of the last episode of one show as recorded by refresh_show() or the last library pass."""
+        entry = self._episode_cache.get(show_obj.ratingKey)
+        return entry[1][0] if entry else None
+
+    def finale_is_only_unwatched(self, show_obj, season, episode):
+        """only_finale_unwatched() for one show, from the episode data recorded by refresh_show()."""
+        entry = self._episode_cache.get(show_obj.ratingKey)
+        return bool(entry) and entry[1][1].get(season) == {episode}
+
+    def show_is_skipped(self, show_obj, skip_genres, genres_to_skip, skip_labels, labels_to_skip):
+        """skipped_show_keys() for one refreshed show, from its own genres and labels instead of library searches."""
+        if skip_genres:
+            wanted = {str(tag).lower() for tag in genres_to_skip}
+            if any(genre.lower() in wanted for genre in bulk_tags(show_obj, 'genres')):
+                return True
+        if skip_labels:
+            wanted = {str(tag).lower() for tag in labels_to_skip}
+            if any(label.lower() in wanted for label in self.snapshot.labels(show_obj)):
+                return True
+        return False
+
+    def season_counters(self):
+        """(show ratingKey, season number) -> (leafCount, viewedLeafCount, season ratingKey), from one paged season listing."""
+        if self._season_counters is None:
+            # Published only once complete, the context can be shared by methods running side by side
+            counters = {}
+            for season in self.section.search(libtype='season', container_size=HYDRATE_PAGE_SIZE):
+                data = season.__dict__
+                counters[(data.get('parentRatingKey'), data.get('index'))] = (
+                    data.get('leafCount') or 0, data.get('viewedLeafCount') or 0, data.get('ratingKey')
+                )
+            self._season_counters = counters
+        return self._season_counters
+
+    def last_episodes(self):
+        """
+        Show ratingKey -> (season number, episode number, title) of its last episode, for the whole
+        library. Episodes are listed page by page and reduced to the highest (season, episode) per
+        show in one streaming pass, so no show needs a reload or its own season/episode requests.
+        The same pass records the unwatched episodes, see unwatched_episodes().
+
+        On a context kept over several cycles only the shows whose episode counters changed since
+        the previous cycle are listed again, unless there are more than INCREMENTAL_EPISODE_LIMIT.
+        """
+        if self._last_episodes is None:
+            stamps = {show.ratingKey: _episode_stamp(show) for show in self.shows}
+            previous = self._episode_cache
+            changed = [key for key, stamp in stamps.items() if key not in previous or previous[key][0] != stamp]
+
+            per_show = {}
+            if previous and len(changed) <= INCREMENTAL_EPISODE_LIMIT:
+                per_show = {key: previous[key][1] for key in stamps if key not in changed}
+                for key in changed:
+                    per_show[key] = [None, {}]
+                    _reduce_episodes(self.server.fetchItems(f"/library/metadata/{key}/allLeaves"), per_show)
+            else:
+                start = 0
+                while True:
+                    page = self.section.search(
+                        libtype='episode', container_start=start,
+                        container_size=HYDRATE_PAGE_SIZE, maxresults=HYDRATE_PAGE_SIZE
+                    )
+                    _reduce_episodes(page, per_show)
+                    if len(page) < HYDRATE_PAGE_SIZE:
+                        break
+                    start += HYDRATE_PAGE_SIZE
+
+            last_episodes = {}
+            unwatched = {}
+            for key, (last, unwatched_by_season) in per_show.items():
+                if last is not None:
+                    last_episodes[key] = last
+                for season, numbers in unwatched_by_season.items():
+                    unwatched[(key, season)] = numbers
+            self._episode_cache = {key: (stamp, per_show.get(key, [None, {}])) for key, stamp in stamps.items()}
+            self._last_episodes = last_episodes
+            if self._unwatched_episodes is None:
+                self._unwatched_episodes = unwatched
+        return self._last_episodes
+
+    def unwatched_episodes(self):
+        """
+        (show ratingKey, season number) -> set of unwatched episode numbers, recorded by the
+        last_episodes() pass of this cycle. On a context kept from a previous cycle that pass
+        only lists the shows whose episodes changed.
+        """
+        if self._unwatched_episodes is None:
+            self.last_episodes()
+        return self._unwatched_episodes
+
+    def only_finale_unwatched(self, candidates):
+        """
+        Evaluate (show, season number, episode number) candidates all at once and return the
+        (ratingKey, season, episode) keys whose finale is the only unwatched episode of its season.
+        The season watch counters rule out most candidates. For seasons with exactly one unwatched
+        episode left, the episodes of just those seasons are listed to see whether it is the finale,
+        unless the unwatched episodes of the library are already known from an episode pass.
+        """
+        candidates = [(show.ratingKey, season, episode) for show, season, episode in candidates]
+        if not candidates:
+            return set()
+
+        try:
+            counters = self.season_counters()
+            one_left = []
+            for candidate in candidates:
+                leaf_count, viewed_leaf_count, _ = counters.get(candidate[:2], (0, 0, None))
+                if leaf_count > 0 and leaf_count - viewed_leaf_count == 1:
+                    one_left.append(candidate)
+            if not one_left:
+                return set()
+
+            if self._unwatched_episodes is not None or self._episode_cache:
+                unwatched = self.unwatched_episodes()
+                return {
+                    (key, season, episode) for key, season, episode in one_left
+                    if unwatched.get((key, season)) == {episode}
+                }
+
+            # One request per remaining season, independent of the library size
+            only_unwatched = set()
+            for key, season, episode in one_left:
+                season_key = counters[(key, season)][2]
+                for item in self.server.fetchItems(f"/library/metadata/{season_key}/children"):
+                    data = item.__dict__
+                    if data.get('index') == episode and not data.get('viewCount'):
+                        only_unwatched.add((key, season, episode))
+            return only_unwatched
+        except Exception as e:
+            print(f"{RED}ERROR: Failed to check watch status in Plex: {e}{RESET}")
+            return set()
+
+    def search_shows_by_tags(self, field, tags):
+        """
+        Server-side search for the shows carrying any of `tags` in `field` ('label' or 'genre').
+        Tags are matched case-insensitively against the values that exist in the library,
+        so unknown tags cost no search at all. Returns a list of show objects.
+        """
+        wanted = {str(tag).lower() for tag in tags}
+        if not wanted:
+            return []
+        try:
+            choices = [
+                choice for choice in self.section.listFilterChoices(field, libtype='show')
+                if choice.title.lower() in wanted
+            ]
+            if not choices:
+                return []
+            return self.section.search(
+                libtype='show', container_size=HYDRATE_PAGE_SIZE, **{field: choices}
+            )
+        except Exception as e:
+            print(f"{RED}ERROR: Failed to search Plex for shows by {field} {sorted(wanted)}: {e}{RESET}")
+            return []
+
+    def keys_with_tags(self, field, tags):
+        """ratingKeys of the shows carrying any of `tags` in `field`, memoized for the run."""
+        cache_key = (field, frozenset(str(tag).lower() for tag in tags))
+        if cache_key not in self._tag_searches:
+            self._tag_searches[cache_key] = {show.ratingKey for show in self.search_shows_by_tags(field, tags)}
+        return self._tag_searches[cache_key]
+
+    def skipped_show_keys(self, skip_genres, genres_to_skip, skip_labels, labels_to_skip):
+        """ratingKeys of the shows excluded by the genre and label skip settings."""
+        skipped = set()
+        if skip_genres:
+            skipped |= self.keys_with_tags('genre', genres_to_skip)
+        if skip_labels:
+            skipped |= self.keys_with_tags('label', labels_to_skip)
+        return skipped
+
+class ShowSnapshot:
+    """
+    Labels of every show as listed at the start of the run, keyed by ratingKey. Drives the label
+    decisions of the run and is updated locally after our own writes, so shows are only reloaded
+    when a write failed or verification is requested.
+    """
+    def __init__(self, shows):
+        self.shows = {show.ratingKey: show for show in shows}
+        self._labels = {show.ratingKey: bulk_tags(show, 'labels') for show in shows}
+        # Held by LabelBatch.apply() so methods sharing the snapshot never write from outdated labels
+        self.write_lock = threading.Lock()
+
+    def labels(self, show_obj):
+        return list(self._labels.get(show_obj.ratingKey, []))
+
+    def shows_with_labels(self, labels):
+        """Shows carrying any of `labels` (case-insensitive), in library order."""
+        wanted = {str(label).lower() for label in labels}
+        return [
+            show for key, show in self.shows.items()
+            if any(label.lower() in wanted for label in self._labels.get(key, []))
+        ]
+
+    def apply_outcomes(self, outcomes):
+        """Record the results of LabelBatch.apply(). Shows whose write failed are reloaded."""
+        failed = {}
+        for show_obj, label, action, success in outcomes:
+            if not success:
+                failed[show_obj.ratingKey] = show_obj
+                continue
+            labels = self._labels.setdefault(show_obj.ratingKey, [])
+            if action == '+' and label not in labels:
+                labels.append(label)
+            elif action == '-' and label in labels:
+                labels.remove(label)
+        for show_obj in failed.values():
+            self.refresh(show_obj)
+
+    def refresh(self, show_obj):
+        """Reload one show from Plex and return its current labels."""
+        try:
+            show_obj.reload()
+            self._labels[show_obj.ratingKey] = [tag.tag for tag in show_obj.labels]
+        except Exception as e:
+            print(f"{RED}ERROR: Failed to reload show '{show_obj.title}': {e}{RESET}")
+        return self.labels(show_obj)
+
+    def verify(self, show_objs):
+        """Reload the given shows and report those whose labels in Plex differ from the snapshot."""
+        mismatched = []
+        for show_obj in show_objs:
+            expected = sorted(self.labels(show_obj))
+            if sorted(self.refresh(show_obj)) != expected:
+                mismatched.append(show_obj)
+                print(f"{RED}ERROR: Labels of '{show_obj.title}' in Plex don't match the expected labels {expected}{RESET}")
+        return mismatched
+
+class LabelBatch:
+    """
+    Collects label adds and removes for many shows and writes them with Plex multi-item edits:
+    one addLabel() or removeLabel() request per label, for up to MULTI_EDIT_CHUNK_SIZE shows.
+    Only the label itself is sent, so labels added in Plex while the run was going are kept.
+    Current labels are taken from the run's snapshot (or the bulk listing) to decide what to queue.
+    """
+    # plexapi keeps batch edits on the section object, so only one batch may be open at a time
+    _edit_lock = threading.Lock()
+
+    def __init__(self, section, snapshot=None):
+        self.section = section
+        self.snapshot = snapshot
+        self._shows = {}
+        self._adds = {}
+        self._removes = {}
+
+    def add(self, show, label):
+        self._shows[show.ratingKey] = show
+        self._adds.setdefault(show.ratingKey, []).append(label)
+
+    def remove(self, show, label):
+        self._shows[show.ratingKey] = show
+        self._removes.setdefault(show.ratingKey, []).append(label)
+
+    def __len__(self):
+        return len(self._shows)
+
+    def current_labels(self, show):
+        """Labels of a show before the collected edits are written."""
+        if self.snapshot is not None:
+            return self.snapshot.labels(show)
+        return bulk_tags(show, 'labels')
+
+    def apply(self):
+        """
+        Write all collected edits. Returns (show, label, action, success) tuples in the order
+        the edits were collected, with action '+' for adds and '-' for removes.
+        The snapshot, if any, is updated with the outcomes before other batches may write.
+        """
+        with self.snapshot.write_lock if self.snapshot is not None else nullcontext():
+            outcomes = self._write()
+            if self.snapshot is not None:
+                self.snapshot.apply_outcomes(outcomes)
+        return outcomes
+
+    def _write(self):
+        # (action, label) -> shows, removes first so a label that is removed and added again ends up set
+        edits = {}
+        for action, queued in (('-', self._removes), ('+', self._adds)):
+            for key, labels in queued.items():
+                for label in dict.fromkeys(labels):
+                    edits.setdefault((action, label), []).append(self._shows[key])
+
+        failed = set()
+        for (action, label), shows in edits.items():
+            for i in range(0, len(shows), MULTI_EDIT_CHUNK_SIZE):
+                chunk = shows[i:i + MULTI_EDIT_CHUNK_SIZE]
+                try:
+                    with self._edit_lock:
+                        self.section.batchMultiEdits(chunk)
+                        if action == '+':
+                            self.section.addLabel(label)
+                        else:
+                            self.section.removeLabel(label)
+                        self.section.saveMultiEdits()
+                except Exception as e:
+                    titles = ', '.join(show.title for show in chunk)
+                    print(f"{RED}ERROR: Failed to update labels for show(s) '{titles}': {e}{RESET}")
+                    failed.update((show.ratingKey, label, action) for show in chunk)
+
+        outcomes = []
+        for key, show in self._shows.items():
+            for label in self._removes.get(key, []):
+                outcomes.append((show, label, '-', (key, label, '-') not in failed))
+            for label in self._adds.get(key, []):
+                outcomes.append((show, label, '+', (key, label, '+') not in failed))
+
+        self._shows, self._adds, self._removes = {}, {}, {}
+        return outcomes
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+class RateLimiter:
+    """
+    Thread-safe token bucket shared by every request to one API. The rate starts at a configured
+    default and is then driven by the limits the API reports in its response headers
+    (Trakt's X-Ratelimit JSON header and Retry-After on 429 responses).
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Tokens per second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Hold back every request for `seconds`, e.g. after a 429."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def update_from_response(self, response):
+        """Adapt the bucket to the rate limit headers of a response."""
+        headers = response.headers
+        raw_limit = headers.get('X-Ratelimit')
+        if raw_limit:
+            try:
+                info = json.loads(raw_limit)
+                limit, period = float(info['limit']), float(info['period'])
+                remaining = float(info.get('remaining', limit))
+            except (ValueError, KeyError, TypeError):
+                info = None
+            if info and limit > 0 and period > 0:
+                with self._lock:
+                    self.rate = limit / period
+                    self._tokens = min(self._tokens, remaining)
+                if remaining <= 0:
+                    self.block(seconds_until(info.get('until')) or period / limit)
+
+        if response.status_code == 429:
+            self.block(retry_after_seconds(headers.get('Retry-After')))
+
+def seconds_until(timestamp):
+    """Seconds from now until an ISO 8601 UTC timestamp, None if it can't be parsed."""
+    if not timestamp:
+        return None
+    try:
+        until = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return max(0.0, (until - datetime.now(timezone.utc)).total_seconds())
+
+def retry_after_seconds(value, default=1.0):
+    """Parse a Retry-After header given in seconds."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,104 @@
+import importlib
+import http_client
+
+# ANSI color codes
+GREEN = '\033[32m'
+ORANGE = '\033[33m'
+BLUE = '\033[34m'
+RED = '\033[31m'
+RESET = '\033[0m'
+BOLD = '\033[1m'
+
+# Series ID prefixes accepted by --relabel -> PlexContext.find_show() argument
+ID_PREFIXES = {
+    'imdb': 'imdb_id',
+    'tmdb': 'tmdb_id',
+    'tvdb': 'tvdb_id',
+    'plex': 'rating_key',
+}
+# Target fields that aren't Plex IDs, handed to the methods per show (see relabel())
+SOURCE_ID_FIELDS = ('sonarr_id',)
+
+def parse_series_ids(values):
+    """'tvdb:81189', 'imdb:tt0903747', 'tmdb:1396' or 'plex:<ratingKey>' -> relabel() targets."""
+    targets = []
+    for value in values:
+        prefix, _, series_id = value.partition(':')
+        if prefix.lower() not in ID_PREFIXES or not series_id.strip():
+            expected = ', '.join(f"{prefix}:<id>" for prefix in ID_PREFIXES)
+            raise ValueError(f"Invalid series ID '{value}'. Expected one of: {expected}")
+        targets.append({ID_PREFIXES[prefix.lower()]: series_id.strip()})
+    return targets
+
+def describe_target(target):
+    return ', '.join(f"{name}={value}" for name, value in target.items() if value)
+
+def relabel_with(module_name, config, plex_ctx, shows, source_ids):
+    """Run the targeted relabeling of one method. Returns its label outcomes, or None if it failed."""
+    try:
+        method = importlib.import_module(module_name)
+        method.init(config)
+        return method.relabel_shows(plex_ctx, shows, source_ids)
+    except SystemExit as error:
+        # Configuration and connection errors end this relabel, not the listener
+        if error.code not in (None, 0):
+            print(f"{RED}An error occurred while relabeling with {module_name}: exit code {error.code}{RESET}")
+    except Exception as error:
+        print(f"{RED}An error occurred while relabeling with {module_name}: {error}{RESET}")
+    return None
+
+def relabel(config, plex_ctx, module_names, targets):
+    """
+    Targeted relabeling: resolve the targets to Plex shows, refresh only those shows and let every
+    method re-evaluate them. Costs a few requests per show instead of a library scan; cached
+    Sonarr and Trakt responses are revalidated, so changes made seconds ago are seen.
+    Returns {method: label outcomes or None}.
+    """
+    shows = {}
+    # ratingKey -> IDs the event carried besides the Plex ones, e.g. {'sonarr_id': 12}
+    source_ids = {}
+    for target in targets:
+        show_ids = {field: target[field] for field in SOURCE_ID_FIELDS if target.get(field)}
+        target = {field: value for field, value in target.items() if field not in SOURCE_ID_FIELDS}
+        try:
+            show_obj = plex_ctx.find_show(**target)
+        except (SystemExit, Exception) as error:
+            print(f"{RED}ERROR: Failed to look up {describe_target(target)} in Plex: {error}{RESET}")
+            continue
+        if show_obj is None:
+            print(f"{ORANGE}No show with {describe_target(target)} in the Plex library, skipping.{RESET}")
+            continue
+        shows[show_obj.ratingKey] = show_obj
+        source_ids.setdefault(show_obj.ratingKey, {}).update(show_ids)
+
+    refreshed = []
+    for show_obj in shows.values():
+        try:
+            plex_ctx.refresh_show(show_obj)
+            refreshed.append(show_obj)
+        except Exception as error:
+            print(f"{RED}ERROR: Failed to refresh show '{show_obj.title}' from Plex: {error}{RESET}")
+    if not refreshed:
+        return {}
+
+    results = {}
+    with http_client.revalidate():
+        for module_name in module_names:
+            titles = ', '.join(f"'{show_obj.title}'" for show_obj in refreshed)
+            print(f"{BOLD}{BLUE}{module_name}: relabeling {titles}{RESET}")
+            results[module_name] = relabel_with(module_name, config, plex_ctx, refreshed, source_ids)
+    return results
+
+def format_relabel_summary(results):
+    """One line per targeted relabel: labels added/removed per method."""
+    if not results:
+        return f"{ORANGE}No shows were relabeled.{RESET}"
+    parts = []
+    for module_name, outcomes in results.items():
+        if outcomes is None:
+            parts.append(f"{module_name}: {RED}failed{RESET}")
+            continue
+        added = sum(1 for _, _, action, success in outcomes if success and action == '+')
+        removed = sum(1 for _, _, action, success in outcomes if success and action == '-')
+        parts.append(f"{module_name}: {GREEN}+{added}{RESET}/{RED}-{removed}{RESET} label(s)")
+    return "Relabel finished | " + " | ".join(parts)
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+import time
+import requests
+from cache_store import cache_path, load_json, save_json
+
+# Subfolder of Cache/ holding one JSON file per cached response
+RESPONSE_CACHE_DIR = "http"
+# Response headers kept with a cached body, ETag/Last-Modified are needed for revalidation
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+class ResponseCache:
+    """
+    Disk cache of successful GET responses. Entries are served while fresh, revalidated with
+    If-None-Match/If-Modified-Since once stale, and the least recently used entries are
+    evicted when the cache grows beyond max_bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._total_bytes = None  # Counted on the first write
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(service, url, params=None):
+        """Cache key of a request. Hashed, so API keys in the URL never end up in file names."""
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        return hashlib.sha256(f"{service} {full_url}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _name(key):
+        return f"{RESPONSE_CACHE_DIR}/{key}.json"
+
+    def load(self, key):
+        """Return the cached entry of a key, or None. Marks the entry as recently used."""
+        entry = load_json(self._name(key))
+        if entry:
+            try:
+                os.utime(cache_path(self._name(key)))
+            except OSError:
+                pass
+        return entry
+
+    @staticmethod
+    def is_fresh(entry, ttl):
+        return time.time() - entry.get('stored_at', 0) < ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Headers that let the server answer 304 Not Modified instead of resending the body."""
+        headers = {}
+        if entry['headers'].get('ETag'):
+            headers['If-None-Match'] = entry['headers']['ETag']
+        if entry['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        return headers
+
+    def store(self, key, response):
+        entry = {
+            'stored_at': time.time(),
+            'status_code': response.status_code,
+            'headers': {name: response.headers[name] for name in STORED_HEADERS if name in response.headers},
+            'body': response.text,
+        }
+        self._save(key, entry)
+
+    def renew(self, key, entry):
+        """Restart the TTL of an entry the server confirmed unchanged."""
+        entry['stored_at'] = time.time()
+        self._save(key, entry)
+
+    @staticmethod
+    def to_response(entry, url):
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response._content = entry['body'].encode("utf-8")
+        response.encoding = "utf-8"
+        response.headers.update(entry['headers'])
+        response.url = url
+        return response
+
+    def _save(self, key, entry):
+        name = self._name(key)
+        path = cache_path(name)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        try:
+            save_json(name, entry)
+            new_size = os.path.getsize(path)
+        except OSError:
+            return  # Caching is best effort
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._total_bytes += new_size - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        folder = cache_path(RESPONSE_CACHE_DIR)
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of its size limit."""
+        files = sorted(self._files(), key=lambda f: f[2])
+        self._total_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except OSError:
+                pass
@@ -0,0 +1,112 @@
+import contextvars
+import io
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+LOGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Logs")
+# Log files kept per method
+MAX_LOG_FILES = 31
+
+# The log the current method run writes to, inherited by propagate_output() workers
+_current_log = contextvars.ContextVar('current_log', default=None)
+_install_lock = threading.Lock()
+
+class Logger:
+    """Writes everything to the terminal and to the log file."""
+    def __init__(self, terminal, log):
+        self.terminal = terminal
+        self.log = log
+
+    def write(self, message):
+        self.terminal.write(message)
+        self.log.write(message)
+
+    def flush(self):
+        self.terminal.flush()
+        self.log.flush()
+
+class _OutputRouter:
+    """
+    Replaces sys.stdout/sys.stderr once per process and sends each write to the Logger of
+    the method run it belongs to, so methods running side by side keep separate logs.
+    """
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+
+    def _target(self):
+        logger = _current_log.get()
+        return getattr(logger, self.name) if logger else self.stream
+
+    def write(self, message):
+        return self._target().write(message)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, attr):
+        # isatty(), encoding, ... of the real stream, e.g. for tqdm
+        return getattr(self.stream, attr)
+
+class _MethodLog:
+    def __init__(self, terminal_out, terminal_err, log):
+        self.stdout = Logger(terminal_out, log)
+        self.stderr = Logger(terminal_err, log)
+
+def _install_router():
+    with _install_lock:
+        if not isinstance(sys.stdout, _OutputRouter):
+            sys.stdout = _OutputRouter(sys.stdout, 'stdout')
+        if not isinstance(sys.stderr, _OutputRouter):
+            sys.stderr = _OutputRouter(sys.stderr, 'stderr')
+
+def clean_old_logs(logs_dir):
+    log_files = sorted(
+        [os.path.join(logs_dir, f) for f in os.listdir(logs_dir) if f.startswith("log_")],
+        key=os.path.getmtime
+    )
+    while len(log_files) > MAX_LOG_FILES:
+        os.remove(log_files.pop(0))
+
+@contextmanager
+def method_log(script_name, buffered=False):
+    """
+    Tee the output of a method run to Logs/<script_name>/log_<timestamp>.txt and clean up old logs.
+    With buffered=True the terminal output is held back and printed in one piece when the run
+    ends, so methods running at the same time don't interleave their output.
+    """
+    _install_router()
+    logs_dir = os.path.join(LOGS_DIR, script_name)
+    os.makedirs(logs_dir, exist_ok=True)
+    log_file = os.path.join(logs_dir, f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    clean_old_logs(logs_dir)
+
+    buffer = io.StringIO() if buffered else None
+    terminal_out = buffer or sys.stdout.stream
+    terminal_err = buffer or sys.stderr.stream
+    with open(log_file, "a", encoding="utf-8") as log:  # Specify UTF-8 encoding
+        token = _current_log.set(_MethodLog(terminal_out, terminal_err, log))
+        try:
+            yield
+        finally:
+            _current_log.reset(token)
+            if buffer is not None:
+                with _install_lock:
+                    sys.stdout.stream.write(buffer.getvalue())
+                    sys.stdout.stream.flush()
+
+def propagate_output(func):
+    """Wrap func so the worker threads running it write to the log of the calling method run."""
+    method_log_ = _current_log.get()
+
+    def wrapper(*args, **kwargs):
+        token = _current_log.set(method_log_)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_log.reset(token)
+
+    return wrapper
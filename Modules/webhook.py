@@ -0,0 +1,177 @@
+import hmac
+import json
+import queue
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from run_logging import propagate_output
+
+# ANSI color codes
+BLUE = '\033[34m'
+RED = '\033[31m'
+RESET = '\033[0m'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8787
+# Seconds events are collected before relabeling, so the episodes of a season pack relabel their show once
+DEBOUNCE_SECONDS = 5
+# Sonarr sends "Download" for On Import and On Upgrade
+SONARR_EVENTS = ('Download',)
+PLEX_EVENTS = ('library.new',)
+# Plex metadata type -> field holding the ratingKey of its show
+PLEX_SHOW_KEY_FIELDS = {
+    'show': 'ratingKey',
+    'season': 'parentRatingKey',
+    'episode': 'grandparentRatingKey',
+}
+
+def parse_payload(content_type, body):
+    """JSON body of a webhook. Plex posts multipart/form-data with the JSON in its 'payload' field."""
+    if content_type.lower().startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'payload':
+                return json.loads(part.get_payload(decode=True))
+        raise ValueError("no 'payload' field in the form data")
+    return json.loads(body or b'{}')
+
+def sonarr_event(payload):
+    """(targets, description) of a Sonarr webhook: the series of an imported episode file."""
+    if payload.get('eventType') not in SONARR_EVENTS:
+        return [], None
+    series = payload.get('series')
+    if not isinstance(series, dict):
+        return [], None
+    target = {'imdb_id': series.get('imdbId'), 'tmdb_id': series.get('tmdbId'), 'tvdb_id': series.get('tvdbId')}
+    if not any(target.values()):
+        return [], None
+    # Lets the Sonarr method fetch this one series instead of looking it up
+    target['sonarr_id'] = series.get('id')
+    return [target], f"Sonarr {payload['eventType']} for '{series.get('title')}'"
+
+def plex_event(payload):
+    """(targets, description) of a Plex webhook: the show of a new show, season or episode."""
+    if payload.get('event') not in PLEX_EVENTS:
+        return [], None
+    metadata = payload.get('Metadata')
+    if not isinstance(metadata, dict):
+        return [], None
+    rating_key = metadata.get(PLEX_SHOW_KEY_FIELDS.get(metadata.get('type'), ''))
+    if not rating_key:
+        return [], None
+    title = metadata.get('grandparentTitle') or metadata.get('parentTitle') or metadata.get('title')
+    return [{'rating_key': rating_key}], f"Plex {payload['event']} for '{title}'"
+
+WEBHOOKS = {
+    '/sonarr': sonarr_event,
+    '/plex': plex_event,
+}
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server_version = "FLFP"
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        token = self.server.token
+        given = parse_qs(url.query).get('token', [''])[0]
+        # Compared as bytes: compare_digest() raises TypeError for non-ASCII str
+        if token and not hmac.compare_digest(given.encode("utf-8"), str(token).encode("utf-8")):
+            return self._reply(403, "Invalid token")
+
+        event_targets = WEBHOOKS.get(url.path.rstrip('/'))
+        if event_targets is None:
+            return self._reply(404, f"Unknown webhook, use {' or '.join(WEBHOOKS)}")
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = parse_payload(self.headers.get('Content-Type', ''), self.rfile.read(length))
+        except ValueError as e:
+            return self._reply(400, f"Invalid payload: {e}")
+        if not isinstance(payload, dict):
+            return self._reply(400, "Invalid payload: expected a JSON object")
+
+        targets, description = event_targets(payload)
+        if not targets:
+            # Test events and events we don't relabel for are acknowledged, so senders don't retry them
+            return self._reply(200, "Ignored")
+        self.server.events.put((description, targets))
+        self._reply(202, "Queued")
+
+    def _reply(self, status, message):
+        body = message.encode("utf-8")
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Accepted events are reported by the worker
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Listens for Sonarr and Plex webhooks and hands their targets to `handle_targets` on a single
+    worker thread, so relabels never run at the same time. Events arriving within DEBOUNCE_SECONDS
+    of each other are handled together and every show is relabeled once.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, token, handle_targets):
+        super().__init__(address, WebhookHandler)
+        self.token = token
+        self.handle_targets = handle_targets
+        self.events = queue.Queue()
+        self._workers = []
+
+    def start(self):
+        # Both threads write to the log of the caller
+        for target in (self.serve_forever, self._work):
+            thread = threading.Thread(target=propagate_output(target), daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def stop(self):
+        """Stop accepting requests and wait for the relabel in progress, if any."""
+        self.shutdown()
+        self.server_close()
+        self.events.put(None)
+        for thread in self._workers:
+            thread.join()
+
+    def _next_batch(self):
+        """Block for an event, then collect what arrives within DEBOUNCE_SECONDS. Returns (events, stop)."""
+        event = self.events.get()
+        if event is None:
+            return [], True
+        batch = [event]
+        deadline = time.monotonic() + DEBOUNCE_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch, False
+            try:
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                return batch, False
+            if event is None:
+                return batch, True
+            batch.append(event)
+
+    def _work(self):
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                targets = {}
+                for description, event_targets in batch:
+                    print(f"{BLUE}Webhook: {description}{RESET}")
+                    for target in event_targets:
+                        targets.setdefault(tuple(sorted(target.items())), target)
+                try:
+                    self.handle_targets(list(targets.values()))
+                except Exception as e:
+                    print(f"{RED}ERROR: Failed to relabel after webhook: {e}{RESET}")
+            if stop:
+                return